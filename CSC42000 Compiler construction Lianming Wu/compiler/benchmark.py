@@ -0,0 +1,384 @@
+# Benchmarks for the compiler, run from the compiler folder:
+#   python benchmark.py input --statements 1000000
+#   python benchmark.py scaling --output results.json
+#   python benchmark.py compare old.json new.json
+#   python benchmark.py incremental
+#   python benchmark.py backends
+#   python benchmark.py loops
+# The input benchmark runs every scanner in its own python process, so the peak memory of one does not hide the others.
+# The scaling benchmark measures the peak of every phase with tracemalloc
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import compiler
+
+
+# Write a program with the given number of assignment statements to path, one line at a time so the generator itself
+# does not need the whole source in memory
+def generate_program(path, statements):
+    with open(path, 'w') as out:
+        out.write('PROGRAM Generated;\nVAR\n   a, b, c : INTEGER;\n   r : REAL;\nBEGIN\n   a := 1;\n   b := 2;\n')
+        for i in range(statements):
+            out.write('   c := (a * {i} + b) DIV 3 - {i} % 7; {{statement {i}}}\n'.format(i=i))
+            out.write('   r := c / 2.5;\n')
+        out.write('   a := c\nEND.\n')
+
+
+# peak resident memory of this process in KB, ru_maxrss is in bytes on macOS
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024
+    return peak
+
+
+# the scanners compared by the input benchmark, 'string' is the old path that reads the whole file first
+def make_scanner(mode, path):
+    if mode == 'string':
+        with open(path, 'r') as source:
+            return compiler.Scanner(source.read())
+    elif mode == 'mmap':
+        return compiler.FileScanner(path)
+    else:
+        return compiler.FileScanner(path, compiler.CHUNK_SIZE)
+
+
+# runs in the child process: lex the whole file and report the numbers as json on stdout
+def scan_child(mode, path):
+    start = time.perf_counter()
+    scanner = make_scanner(mode, path)
+    tokens = 0
+    while scanner.get_next_token().tk_type != compiler.TK_EOF:
+        tokens += 1
+    seconds = time.perf_counter() - start
+    print(json.dumps({'mode': mode, 'tokens': tokens, 'seconds': seconds, 'peak_rss_kb': peak_rss_kb()}))
+
+
+def run_child(*args):
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), 'child'] + [str(arg) for arg in args])
+    return json.loads(output.decode())
+
+
+# whole-string scanner against the mmap and chunked FileScanner on the same generated file
+def input_benchmark(options):
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'generated.pas')
+        generate_program(path, options.statements)
+        size = os.path.getsize(path)
+        baseline = run_child('baseline', path)
+        print('source: {mb:.1f} MB, python itself: {rss:.1f} MB'.format(
+            mb=size / 1e6, rss=baseline['peak_rss_kb'] / 1e3))
+        print('{mode:<8} {tokens:>10} {seconds:>8} {rate:>12} {rss:>10}'.format(
+            mode='mode', tokens='tokens', seconds='seconds', rate='tokens/s', rss='peak MB'))
+        for mode in ('string', 'mmap', 'chunked'):
+            result = run_child('scan', mode, path)
+            print('{mode:<8} {tokens:>10} {seconds:>8.2f} {rate:>12.0f} {rss:>10.1f}'.format(
+                mode=mode, tokens=result['tokens'], seconds=result['seconds'],
+                rate=result['tokens'] / result['seconds'], rss=result['peak_rss_kb'] / 1e3))
+
+
+# Programs for the scaling benchmark, each one grows along one axis: the number of declarations, of statements, the
+# depth of an expression, the nesting of BEGIN END blocks and the number of times a REPEAT loop runs
+def declarations_program(size):
+    names = ['v{i}'.format(i=i) for i in range(size)]
+    lines = ['PROGRAM Declarations;', 'VAR', '   {names} : INTEGER;'.format(names=', '.join(names)), 'BEGIN']
+    lines.append(';\n'.join('   {name} := {i}'.format(name=name, i=i) for i, name in enumerate(names)))
+    lines.append('END.')
+    return '\n'.join(lines)
+
+
+def statements_program(size):
+    body = ';\n'.join('   c := (a * {i} + b) DIV 3 - {i} % 7'.format(i=i) for i in range(size))
+    return 'PROGRAM Statements;\nVAR a, b, c : INTEGER;\nBEGIN\n   a := 1;\n   b := 2;\n{body}\nEND.'.format(body=body)
+
+
+def depth_program(size):
+    expr = 'a'
+    for i in range(size):
+        expr = '({i} + a * {expr})'.format(i=i % 10, expr=expr) if i % 2 else '(a - {expr})'.format(expr=expr)
+    return 'PROGRAM Depth;\nVAR a, b : INTEGER;\nBEGIN\n   a := 1;\n   b := {expr} % 1000\nEND.'.format(expr=expr)
+
+
+def nesting_program(size):
+    return 'PROGRAM Nesting;\nVAR a : INTEGER;\nBEGIN\n   a := 0;\n{open}   a := a + 1\n{close}END.'.format(
+        open='   BEGIN\n' * size, close='   END;\n' * size)
+
+
+def iterations_program(size):
+    return ('PROGRAM Iterations;\nVAR i, s : INTEGER;\n   r : REAL;\nBEGIN\n   i := 0;\n   s := 0;\n   r := 0.0;\n'
+            '   REPEAT\n      i := i + 1;\n      s := (s + i * 3) % 1000;\n      r := r + s / 2\n'
+            '   UNTIL i >= {size}\nEND.'.format(size=size))
+
+
+AXES = {'declarations': declarations_program, 'statements': statements_program, 'depth': depth_program,
+        'nesting': nesting_program, 'iterations': iterations_program}
+SIZES = {'declarations': [100, 1000, 10000], 'statements': [100, 1000, 10000], 'depth': [10, 50, 150, 1000, 5000],
+         'nesting': [10, 50, 150], 'iterations': [100, 1000, 10000, 100000]}
+QUICK_SIZES = {'declarations': [100, 1000], 'statements': [100, 1000], 'depth': [10, 50],
+               'nesting': [10, 50], 'iterations': [100, 1000]}
+
+
+# Run one phase twice: first for the time, then again under tracemalloc for the peak memory it allocates.
+# Returns the result of the first run and the measurements
+def measure(phase, *args):
+    start = time.perf_counter()
+    result = phase(*args)
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    phase(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, {'seconds': seconds, 'peak_bytes': peak}
+
+
+def dump_trace(code, path):
+    compiler.write_trace(path, code)
+    return os.path.getsize(path)
+
+
+# All the phases of one program: scanning, parsing (scanner included), interpreting, writing simple_stack, generating
+# the stack code and running it on the stack machine
+def run_case(text, folder):
+    phases = {}
+    tokens, phases['scan'] = measure(compiler.tokenize, text)
+    phases['scan']['tokens'] = len(tokens[0]) - 1
+    phases['scan']['tokens_per_second'] = phases['scan']['tokens'] / max(phases['scan']['seconds'], 1e-9)
+    program, phases['parse'] = measure(lambda: compiler.Parser(compiler.Scanner(text)).program())
+
+    def interpret():
+        interpreter = compiler.Interpreter(program)
+        interpreter.run()
+        return interpreter
+    interpreter, phases['interpret'] = measure(interpret)
+    size, phases['dump'] = measure(dump_trace, interpreter.code, os.path.join(folder, 'simple_stack'))
+    phases['dump']['trace_instructions'] = len(interpreter.code)
+    phases['dump']['file_bytes'] = size
+    del interpreter
+    code, phases['compile'] = measure(lambda: compiler.CodeGenerator(program).generate())
+    phases['compile']['instructions'] = len(code.ops)
+    _, phases['execute'] = measure(lambda: compiler.StackMachine(code).run())
+    return phases
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def scaling_benchmark(options):
+    sizes = QUICK_SIZES if options.quick else SIZES
+    axes = options.axes or list(AXES)
+    results = []
+    print('{axis:<13} {size:>7} {phase:<10} {seconds:>9} {peak:>10}  extra'.format(
+        axis='axis', size='size', phase='phase', seconds='seconds', peak='peak KB'))
+    with tempfile.TemporaryDirectory() as folder:
+        for axis in axes:
+            for size in sizes[axis]:
+                case = {'axis': axis, 'size': size}
+                text = AXES[axis](size)
+                case['source_bytes'] = len(text)
+                try:
+                    case['phases'] = run_case(text, folder)
+                except (Exception, RecursionError) as error:
+                    case['error'] = '{kind}: {error}'.format(kind=type(error).__name__, error=error)
+                    print('{axis:<13} {size:>7} {error}'.format(axis=axis, size=size, error=case['error']))
+                results.append(case)
+                for phase, numbers in case.get('phases', {}).items():
+                    extra = dict((key, value) for key, value in numbers.items() if key not in ('seconds', 'peak_bytes'))
+                    print('{axis:<13} {size:>7} {phase:<10} {seconds:>9.4f} {peak:>10.1f}  {extra}'.format(
+                        axis=axis, size=size, phase=phase, seconds=numbers['seconds'],
+                        peak=numbers['peak_bytes'] / 1024, extra=' '.join(
+                            '{key}={value:.0f}'.format(key=key, value=value) for key, value in extra.items())))
+    report = {'meta': {'commit': git_commit(), 'python': platform.python_version(), 'platform': platform.platform(),
+                       'time': datetime.datetime.now().isoformat(timespec='seconds'), 'quick': options.quick},
+              'results': results}
+    with open(options.output, 'w') as out:
+        json.dump(report, out, indent=2)
+    print('results written to {path}'.format(path=options.output))
+
+
+# Print the change of every time and peak memory between two result files of the scaling benchmark, the ones that
+# got slower or bigger than the threshold are marked
+def compare_results(options):
+    with open(options.old) as old_file, open(options.new) as new_file:
+        old, new = json.load(old_file), json.load(new_file)
+    before = dict(((case['axis'], case['size']), case.get('phases', {})) for case in old['results'])
+    for case in new['results']:
+        for phase, numbers in case.get('phases', {}).items():
+            previous = before.get((case['axis'], case['size']), {}).get(phase)
+            if previous is None:
+                continue
+            for key in ('seconds', 'peak_bytes'):
+                ratio = numbers[key] / max(previous[key], 1e-9)
+                mark = '  <-- regression' if ratio > 1 + options.threshold else ''
+                print('{axis:<13} {size:>7} {phase:<10} {key:<10} {ratio:>6.2f}x{mark}'.format(
+                    axis=case['axis'], size=case['size'], phase=phase, key=key, ratio=ratio, mark=mark))
+
+
+# Time of one edit with the incremental compiler against compiling the whole source again, for programs of growing
+# size. The edit changes a constant in a statement near the start, in the middle and near the end
+def incremental_benchmark(options):
+    print('{size:>7} {full:>10} {where:<7} {edit:>10} {reparsed:>9}'.format(
+        size='size', full='full ms', where='edit', edit='edit ms', reparsed='reparsed'))
+    for size in options.sizes:
+        text = statements_program(size)
+        start = time.perf_counter()
+        incremental = compiler.IncrementalCompiler(text)
+        full = time.perf_counter() - start
+        for where, fraction in (('start', 0.0), ('middle', 0.5), ('end', 1.0)):
+            offset = text.index(' DIV 3', int(len(text) * fraction * 0.99))
+            seconds = []
+            for i in range(options.repeat):
+                start = time.perf_counter()
+                incremental.edit(offset + 5, 1, str(4 + i % 5))
+                seconds.append(time.perf_counter() - start)
+            reparsed = incremental.reparsed[1] - incremental.reparsed[0] if incremental.reparsed else len(text)
+            print('{size:>7} {full:>10.2f} {where:<7} {edit:>10.3f} {reparsed:>9}'.format(
+                size=size, full=full * 1e3, where=where, edit=sorted(seconds)[len(seconds) // 2] * 1e3,
+                reparsed=reparsed))
+
+
+# How many instructions a run of some code executes. There are no jumps but the ones back to the top of a loop, so an
+# instruction runs as many times as the body of the innermost loop around it. loops has the (top, jump) of every loop
+# in the code and evaluations how many times the body of every loop ran, in the order the loops start in the source
+def executed_instructions(length, loops, evaluations):
+    runs = [1] * length
+    # the outer loop of two that start at the same place jumps last, outer loops go first and the inner ones overwrite
+    for (top, jump), count in zip(sorted(loops, key=lambda loop: (loop[0], -loop[1])), evaluations):
+        runs[top:jump + 1] = [count] * (jump + 1 - top)
+    return sum(runs)
+
+
+# the best time of a few runs of a machine, make builds a new one every time
+def best_time(make, repeat):
+    seconds = []
+    for _ in range(repeat):
+        machine = make()
+        start = time.perf_counter()
+        machine.run()
+        seconds.append(time.perf_counter() - start)
+    return min(seconds)
+
+
+# The stack code against the three-address code of the same programs: the number of instructions in the code, how many
+# of them a run executes and the time of a run. The stack machine runs once without and once with translated loops
+def backends_benchmark(options):
+    print('{axis:<11} {size:>7} {form:<9} {code:>9} {executed:>11} {seconds:>9} {tiered:>9}'.format(
+        axis='program', size='size', form='backend', code='code', executed='executed', seconds='seconds',
+        tiered='tiered'))
+    for axis in ('statements', 'depth', 'iterations'):
+        for size in options.sizes[axis]:
+            program = compiler.Parser(compiler.Scanner(AXES[axis](size))).program()
+            compiler.optimize_program(program, options.optimize)
+            profile = compiler.Profile()
+            compiler.ProfilingInterpreter(program, profile).run()
+            evaluations = [profile.counts[node] for node in compiler.walk_statements(program.block.statements)
+                           if isinstance(node, compiler.Repeat)]
+            stack = compiler.CodeGenerator(program, options.optimize).generate()
+            loops = [(arg, pc) for pc, (op, arg) in enumerate(zip(stack.ops, stack.args)) if op in compiler.JUMPS]
+            print('{axis:<11} {size:>7} {form:<9} {code:>9} {executed:>11} {seconds:>9.4f} {tiered:>9.4f}'.format(
+                axis=axis, size=size, form='stack', code=len(stack.ops),
+                executed=executed_instructions(len(stack.ops), loops, evaluations),
+                seconds=best_time(lambda: compiler.StackMachine(stack, None), options.repeat),
+                tiered=best_time(lambda: compiler.StackMachine(stack), options.repeat)))
+            registers = compiler.RegisterGenerator(program, options.optimize).generate()
+            loops = [(rd, pc) for pc, (op, rd, rt, rs) in enumerate(registers.instructions) if op in compiler.JUMPS]
+            print('{axis:<11} {size:>7} {form:<9} {code:>9} {executed:>11} {seconds:>9.4f} {tiered:>9}'.format(
+                axis=axis, size=size, form='register', code=len(registers.instructions),
+                executed=executed_instructions(len(registers.instructions), loops, evaluations),
+                seconds=best_time(lambda: compiler.RegisterMachine(registers), options.repeat), tiered='-'))
+
+
+# A loop with invariant expressions and products of its counter, what the -O3 loop passes are for
+def invariant_program(size):
+    return ('PROGRAM Invariant;\nVAR i, n, k, s, t : INTEGER;\n   w, r : REAL;\nBEGIN\n   n := {size};\n   k := 7;\n'
+            '   w := 1.5;\n   i := 0;\n   s := 0;\n   t := 0;\n   r := 0.0;\n   REPEAT\n'
+            '      s := (s + i * 12 + n * k - 3) % 1000003;\n      t := t + i * 8 + (k + 1) * (k - 1);\n'
+            '      r := r + w * 2 + k * w;\n      i := i + 1\n   UNTIL i >= n\nEND.'.format(size=size))
+
+
+# The register code of invariant_program at -O2 and -O3: the instructions in the code, how many a run executes and how
+# many of them every iteration of the loop executes, and the time of a run
+def loops_benchmark(options):
+    print('{size:>7} {level:>5} {code:>6} {executed:>10} {per:>10} {seconds:>9}'.format(
+        size='size', level='level', code='code', executed='executed', per='iteration', seconds='seconds'))
+    for size in options.iterations:
+        for level in (2, 3):
+            program = compiler.Parser(compiler.Scanner(invariant_program(size))).program()
+            compiler.optimize_program(program, level)
+            code = compiler.RegisterGenerator(program, level).generate()
+            loops = [(rd, pc) for pc, (op, rd, rt, rs) in enumerate(code.instructions) if op in compiler.JUMPS]
+            top, jump = loops[0]
+            print('{size:>7} {level:>5} {code:>6} {executed:>10} {per:>10} {seconds:>9.4f}'.format(
+                size=size, level=level, code=len(code.instructions),
+                executed=executed_instructions(len(code.instructions), loops, [size]), per=jump + 1 - top,
+                seconds=best_time(lambda: compiler.RegisterMachine(code), options.repeat)))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='compiler benchmarks')
+    commands = arg_parser.add_subparsers(dest='command')
+    command = commands.add_parser('input', help='peak memory and throughput of the string, mmap and chunked scanners')
+    command.add_argument('--statements', type=int, default=200000)
+    command = commands.add_parser('scaling', help='time and peak memory of every phase on generated programs')
+    command.add_argument('--output', default='benchmark_results.json', help='where to write the results as json')
+    command.add_argument('--axes', nargs='*', choices=sorted(AXES), help='only run these axes')
+    command.add_argument('--quick', action='store_true', help='smaller programs')
+    command = commands.add_parser('compare', help='compare two results files of the scaling benchmark')
+    command.add_argument('old')
+    command.add_argument('new')
+    command.add_argument('--threshold', type=float, default=0.1, help='mark changes above this fraction')
+    command = commands.add_parser('incremental', help='time of an edit with the incremental compiler')
+    command.add_argument('--sizes', type=int, nargs='*', default=[1000, 10000, 100000], help='statements')
+    command.add_argument('--repeat', type=int, default=20, help='edits timed at every place')
+    command = commands.add_parser('backends', help='the stack code against the three-address code')
+    command.add_argument('--statements', type=int, nargs='*', default=[1000, 10000], help='sizes of the statements '
+                         'program')
+    command.add_argument('--depth', type=int, nargs='*', default=[50, 150], help='sizes of the depth program')
+    command.add_argument('--iterations', type=int, nargs='*', default=[10000, 100000],
+                         help='sizes of the iterations program')
+    command.add_argument('-O', dest='optimize', type=int, default=0, choices=compiler.OPTIMIZE_LEVELS)
+    command.add_argument('--repeat', type=int, default=3, help='runs timed of every machine, the best one counts')
+    command = commands.add_parser('loops', help='the three-address code of a loop at -O2 and -O3')
+    command.add_argument('--iterations', type=int, nargs='*', default=[10000, 100000])
+    command.add_argument('--repeat', type=int, default=3, help='runs timed of every level, the best one counts')
+    # used by the benchmarks to measure in a fresh process
+    command = commands.add_parser('child')
+    command.add_argument('what')
+    command.add_argument('args', nargs='*')
+    options = arg_parser.parse_args()
+    if options.command == 'input':
+        input_benchmark(options)
+    elif options.command == 'scaling':
+        scaling_benchmark(options)
+    elif options.command == 'compare':
+        compare_results(options)
+    elif options.command == 'incremental':
+        incremental_benchmark(options)
+    elif options.command == 'backends':
+        options.sizes = {'statements': options.statements, 'depth': options.depth, 'iterations': options.iterations}
+        backends_benchmark(options)
+    elif options.command == 'loops':
+        loops_benchmark(options)
+    elif options.command == 'child' and options.what == 'scan':
+        scan_child(*options.args)
+    elif options.command == 'child' and options.what == 'baseline':
+        print(json.dumps({'peak_rss_kb': peak_rss_kb()}))
+    else:
+        arg_parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
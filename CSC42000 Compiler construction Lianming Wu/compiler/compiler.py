@@ -2,7 +2,21 @@
 # INT token is for the declaration where INT_CONST token is for immediate values
 # similar for the REAL_CONST
 # DIV in pascal means integer divide, so we need a F_DIV for float divide
+import argparse
+import bisect
+import concurrent.futures
+import contextlib
+import hashlib
+import itertools
 import json
+import mmap
+import operator
+import os
+import re
+import struct
+import sys
+import time
+from array import array
 
 TK_BOOL = 0
 TK_INT_CONST = 1
@@ -39,9 +53,43 @@ TK_NOT_EQUAL = 31
 TK_BREAK = 32
 TK_CONTINUE = 33
 
+# Opcodes of the stack machine, integers as well so the machine dispatches on them quickly
+# the argument of PUSH and MOV is the slot of the variable, there is one opcode for each type of variable
+OP_PUSH_INT = 0
+OP_PUSH_REAL = 1
+OP_PUSHI = 2
+OP_MOV_INT = 3
+OP_MOV_REAL = 4
+OP_ADD = 5
+OP_SUB = 6
+OP_MUL = 7
+OP_DIV = 8
+OP_F_DIV = 9
+OP_MOD = 10
+OP_NEG = 11
+OP_JG = 12
+OP_JGE = 13
+OP_JL = 14
+OP_JLE = 15
+OP_JE = 16
+OP_JNE = 17
+# only exists while generating code, removed when the jumps are resolved
+OP_LABEL = 18
+# only in code generated for profiling, adds one to a counter of the machine
+OP_COUNT = 19
+# only in the trace of the interpreter
+OP_POP = 20
+OP_WORD = 21
+# only in three-address code, reading a variable that has no value yet
+OP_UNSET = 22
+# only in three-address code, rt << rs
+OP_SHL = 23
+
 
 # A class to represent a Token with two elements: type of the token, and the value the token have
 class Token(object):
+    __slots__ = ('tk_type', 'value')
+
     def __init__(self, tk_type, value):
         self.tk_type = tk_type
         self.value = value
@@ -53,6 +101,8 @@ class Token(object):
 
 # Instructions that take in 2 parameters other than the instruction if self
 class Two_Instruction(object):
+    __slots__ = ('ins', 'rs', 'rt')
+
     def __init__(self, instruction, rt, rs):
         self.ins = instruction
         self.rs = rs
@@ -64,8 +114,26 @@ class Two_Instruction(object):
         )
 
 
+# Instructions of the three-address code, the register of the result and the two operands
+class Three_Instruction(object):
+    __slots__ = ('ins', 'rd', 'rt', 'rs')
+
+    def __init__(self, instruction, rd, rt, rs):
+        self.ins = instruction
+        self.rd = rd
+        self.rt = rt
+        self.rs = rs
+
+    def __str__(self):
+        return '< {ins} {rd} {rt} {rs} >'.format(
+            ins=self.ins, rd=self.rd, rt=self.rt, rs=self.rs
+        )
+
+
 # Instruction that take in 1 parameter
 class One_Instruction(object):
+    __slots__ = ('ins', 'adr')
+
     def __init__(self, instruction, address):
         self.ins = instruction
         self.adr = address
@@ -86,162 +154,304 @@ KEYWORD = {'BEGIN': Token(TK_BEGIN, 'BEGIN'), 'END': Token(TK_END, 'END'),
            'BREAK': Token(TK_BREAK, 'BREAK'), 'CONTINUE': Token(TK_CONTINUE, 'CONTINUE')
            }
 
+# Same idea for the operators and punctuation, one token object for each of them is shared by the whole program
+SYMBOL = {'*': Token(TK_MUL, '*'), '(': Token(TK_LPR, '('), ')': Token(TK_RPR, ')'),
+          '+': Token(TK_ADD, '+'), '-': Token(TK_MINUS, '-'), '/': Token(TK_F_DIV, '/'),
+          ':=': Token(TK_ASSIGN, ':='), '.': Token(TK_DOT, '.'), ';': Token(TK_SEMI, ';'),
+          ',': Token(TK_COMMA, ','), ':': Token(TK_COLON, ':'), '%': Token(TK_MOD, '%'),
+          '<>': Token(TK_NOT_EQUAL, '<>'), '<=': Token(TK_LESS_THAN, '<='), '>=': Token(TK_GREAT_THAN, '>='),
+          '<': Token(TK_LESS, '<'), '>': Token(TK_GREAT, '>'), '=': Token(TK_EQUAL, '=')
+          }
+
+EOF_TOKEN = Token(TK_EOF, None)
+
+# token type -> the shared token, the scanner only creates new Token objects for identifiers and numbers
+SHARED_TOKEN = dict((token.tk_type, token) for token in list(KEYWORD.values()) + list(SYMBOL.values()))
+SHARED_TOKEN[TK_EOF] = EOF_TOKEN
+# the text of a keyword or symbol -> its token type, this is the dispatch table of the scanner
+TOKEN_TYPE = dict((text, token.tk_type) for text, token in list(KEYWORD.items()) + list(SYMBOL.items()))
+
+# One pattern for the whole language: skip the white spaces and comments, then take the next word, number or symbol.
+# The longer symbols come first so := is not read as : and =, anything else is a single character and an error.
+# At the end of the string the group matches the empty string
+TOKEN_PATTERN = re.compile(r"""
+    \s*(?:\{[^}]*\}\s*)*
+    (\d+\.\d*|\d+|[^\W\d_][^\W_]*|:=|<>|<=|>=|\S|\Z)
+""", re.VERBOSE)
+
+
+# Break the whole input string into tokens in one pass. The result is three parallel arrays: the token types, the
+# token values and the offset where each token starts, the last token is always TK_EOF
+def tokenize(string):
+    types = array('B')
+    values = []
+    offsets = array('q')
+    add_type, add_value, add_offset = types.append, values.append, offsets.append
+    token_type = TOKEN_TYPE.get
+    for match in TOKEN_PATTERN.finditer(string):
+        text = match[1]
+        tk_type = token_type(text)
+        if tk_type is None:
+            if not text:
+                break
+            char = text[0]
+            # for numbers, if we see a dot it is a real, else an integer
+            if char.isdigit():
+                if '.' in text:
+                    tk_type = TK_REAL_CONST
+                    text = float(text)
+                else:
+                    tk_type = TK_INT_CONST
+                    text = int(text)
+            elif char.isalpha():
+                tk_type = TK_ID
+            elif char == '{':
+                raise Exception('Comment starting at {pos} is not closed!'.format(pos=match.start(1)))
+            else:
+                # when not belong to any case, return an error
+                raise Exception('"{char}" can not be recognized by scanner!'.format(char=char))
+        add_type(tk_type)
+        add_value(text)
+        add_offset(match.start(1))
+    # indicate end of file
+    add_type(TK_EOF)
+    add_value(None)
+    add_offset(len(string))
+    return types, values, offsets
+
 
 # Scanner or lexer that break the input file or string into tokens, so parser could have access to tokens not single
 # digit character
 class Scanner(object):
 
-    # initialization, pos is the position of the curr_character in the input string
+    # initialization, the whole string is tokenized right away, index is the position of the next token
     def __init__(self, string):
         self.string = string
-        self.pos = 0
-        self.curr_char = self.string[self.pos]
+        self.types, self.values, self.offsets = tokenize(string)
+        self.index = 0
+        self.last = len(self.types) - 1
 
-    # sometime we need to look ahead to see what exactly is current token
-    def look_ahead(self):
-        look_pos = self.pos + 1
-        if look_pos > len(self.string) - 1:
-            return None
-        else:
-            return self.string[look_pos]
-
-    # kind like the match function in parser, go to next position until we reach the end of string
-    # update the curr_char
-    def advance(self):
-        self.pos += 1
-        if self.pos > len(self.string) - 1:
-            self.curr_char = None
-        else:
-            self.curr_char = self.string[self.pos]
-
-    # for identifiers, take in all the alphabetical characters, and if those character forms a keyword, return the
-    # keyword token, if not, return a id token both with the value of the combined char
-    def id(self):
-        string = ''
-        while self.curr_char is not None and self.curr_char.isalnum():
-            string += self.curr_char
-            self.advance()
-        token = KEYWORD.get(string, Token(TK_ID, string))
+    # where the last token returned by get_next_token starts in the string
+    @property
+    def start(self):
+        return self.offsets[self.index - 1]
+
+    # the core of scanner, get next token for the usage of parser. Keeps returning the TK_EOF token at the end
+    def get_next_token(self):
+        index = self.index
+        if index >= self.last:
+            self.index = self.last + 1
+            return EOF_TOKEN
+        self.index = index + 1
+        tk_type = self.types[index]
+        token = SHARED_TOKEN.get(tk_type)
+        if token is None:
+            return Token(tk_type, self.values[index])
         return token
 
-    # similar function as id, take in all the digits, if we see a dot, return real token, else return integer token
-    # with the corresponding value
-    def number(self):
-        num = ''
-        while self.curr_char is not None and self.curr_char.isdigit():
-            num += self.curr_char
-            self.advance()
-        if self.curr_char == '.':
-            num += self.curr_char
-            self.advance()
-            while self.curr_char is not None and self.curr_char.isdigit():
-                num += self.curr_char
-                self.advance()
-            token = Token(TK_REAL_CONST, float(num))
+
+# The same pattern for bytes, used when we lex straight from a file. In a bytes pattern \w only matches ascii letters
+BYTES_TOKEN_PATTERN = re.compile(TOKEN_PATTERN.pattern.encode('ascii'), re.VERBOSE)
+BYTES_TOKEN_TYPE = dict((text.encode('ascii'), tk_type) for text, tk_type in TOKEN_TYPE.items())
+# how many bytes FileScanner reads at a time, and how much of a memory map it lexes before giving the pages back
+CHUNK_SIZE = 1 << 16
+MMAP_WINDOW = 1 << 20
+
+
+# Lex buffer[pos:endpos] and yield (type, value, offset) for every token, offset is counted from base. When final is
+# False the buffer ends in the middle of the file, so the token at the very end (which may continue after it) and a
+# comment that is not closed yet are left alone. Returns where the lexing stopped
+def lex_bytes(buffer, pos, endpos, base, final):
+    token_type = BYTES_TOKEN_TYPE.get
+    for match in BYTES_TOKEN_PATTERN.finditer(buffer, pos, endpos):
+        text = match[1]
+        if not final and (match.end() == endpos or text == b'{' or not text):
+            return match.start()
+        tk_type = token_type(text)
+        if tk_type is None:
+            if not text:
+                break
+            # the value is only copied out of the file now, for identifiers and numbers
+            if text[:1].isdigit():
+                if b'.' in text:
+                    yield TK_REAL_CONST, float(text), base + match.start(1)
+                else:
+                    yield TK_INT_CONST, int(text), base + match.start(1)
+            elif text[:1].isalpha():
+                yield TK_ID, text.decode('ascii'), base + match.start(1)
+            elif text == b'{':
+                raise Exception('Comment starting at {pos} is not closed!'.format(pos=base + match.start(1)))
+            else:
+                raise Exception('"{char}" can not be recognized by scanner!'.format(char=text.decode('latin-1')))
         else:
-            token = Token(TK_INT_CONST, int(num))
+            yield tk_type, None, base + match.start(1)
+    return endpos
 
-        return token
 
-    # only called when we see a {, skip all the characters until we see a } that close the comment
-    def skip_comment(self):
-        while self.curr_char != '}':
-            self.advance()
-        # for skip the }
-        self.advance()
+# Scanner that takes a file path instead of a string. The file is lexed through mmap, or chunk_size bytes at a time
+# when a chunk_size is given or the file can not be mapped. Tokens are only lexed when the parser asks for them and
+# the whole source is never copied into memory, so the memory used does not depend on the size of the source
+class FileScanner(object):
 
-    # a go to function for the usage of repeat
-    def go_to(self, address):
-        self.pos = address
-        self.curr_char = self.string[address]
-        return self.get_next_token()
+    def __init__(self, path, chunk_size=None):
+        self.path = path
+        self.chunk_size = chunk_size
+        # where the last token returned by get_next_token starts in the file
+        self.start = 0
+        self.tokens = self.lex()
 
-    # the core of scanner, get next token for the usage of parser
-    def get_next_token(self):
-        # skip the section if current token is none
-        while self.curr_char is not None:
-            # skip all the white spaces as we don't need them
-            if self.curr_char.isspace():
-                while self.curr_char is not None and self.curr_char.isspace():
-                    self.advance()
-                continue
-            # so for different inputs we got, we return different tokens
-            if self.curr_char.isdigit():
-                return self.number()
-            if self.curr_char == '*':
-                self.advance()
-                return Token(TK_MUL, '*')
-            if self.curr_char == '(':
-                self.advance()
-                return Token(TK_LPR, '(')
-            if self.curr_char == ')':
-                self.advance()
-                return Token(TK_RPR, ')')
-            if self.curr_char == '+':
-                self.advance()
-                return Token(TK_ADD, '+')
-            if self.curr_char == '-':
-                self.advance()
-                return Token(TK_MINUS, '-')
-            if self.curr_char == '/':
-                self.advance()
-                return Token(TK_F_DIV, '/')
-            # use look ahead to see if the : is followed by =, so we don't return TK_COLON when it should be an
-            # assignment
-            if self.curr_char == ':' and self.look_ahead() == '=':
-                self.advance()
-                self.advance()
-                return Token(TK_ASSIGN, ':=')
-            if self.curr_char.isalpha():
-                return self.id()
-            if self.curr_char == '.':
-                self.advance()
-                return Token(TK_DOT, '.')
-
-            if self.curr_char == ';':
-                self.advance()
-                return Token(TK_SEMI, ';')
-            if self.curr_char == ',':
-                self.advance()
-                return Token(TK_COMMA, ',')
-            if self.curr_char == ':':
-                self.advance()
-                return Token(TK_COLON, ':')
-            if self.curr_char == '{':
-                self.advance()
-                self.skip_comment()
-                continue
-            if self.curr_char == '%':
-                self.advance()
-                return Token(TK_MOD, '%')
-            if self.curr_char == '<' and self.look_ahead() == '>':
-                self.advance()
-                self.advance()
-                return Token(TK_NOT_EQUAL, '<>')
-            if self.curr_char == '<' and self.look_ahead() == '=':
-                self.advance()
-                self.advance()
-                return Token(TK_LESS_THAN, '<=')
-            if self.curr_char == '>' and self.look_ahead() == '=':
-                self.advance()
-                self.advance()
-                return Token(TK_GREAT_THAN, '>=')
-            if self.curr_char == '<':
-                self.advance()
-                return Token(TK_LESS, '<')
-            if self.curr_char == '>':
-                self.advance()
-                return Token(TK_GREAT, '>')
-            if self.curr_char == '=':
-                self.advance()
-                return Token(TK_EQUAL, '=')
-            # when not belong to any case, return an error
-            raise Exception('"{char}" can not be recognized by scanner!'.format(char=self.curr_char))
+    def lex(self):
+        with open(self.path, 'rb') as source:
+            buffer = None
+            if self.chunk_size is None:
+                try:
+                    buffer = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+                except (ValueError, OSError):
+                    # empty files and pipes can not be mapped
+                    pass
+            if buffer is not None:
+                with buffer:
+                    end = yield from self.lex_mmap(buffer)
+            else:
+                end = yield from self.lex_chunks(source, self.chunk_size or CHUNK_SIZE)
         # indicate end of file
-        return Token(TK_EOF, None)
+        while True:
+            yield TK_EOF, None, end
+
+    # lex the map one window at a time, and tell the kernel we are done with the pages behind us
+    @staticmethod
+    def lex_mmap(buffer):
+        size = len(buffer)
+        pos = released = 0
+        window = MMAP_WINDOW
+        while True:
+            endpos = min(pos + window, size)
+            final = endpos == size
+            start = pos
+            pos = yield from lex_bytes(buffer, pos, endpos, 0, final)
+            if final:
+                return size
+            # nothing was lexed when a comment, a run of spaces or a token fills the window, it gets twice the room
+            window = window * 2 if pos == start else MMAP_WINDOW
+            done = pos - pos % mmap.PAGESIZE
+            if hasattr(mmap, 'MADV_DONTNEED') and done > released:
+                buffer.madvise(mmap.MADV_DONTNEED, released, done - released)
+                released = done
+
+    # read the file chunk by chunk, the unfinished tail of a chunk is carried over to the next one
+    @staticmethod
+    def lex_chunks(source, chunk_size):
+        carry = b''
+        base = 0
+        while True:
+            chunk = source.read(chunk_size)
+            final = not chunk
+            buffer = carry + chunk
+            stop = yield from lex_bytes(buffer, 0, len(buffer), base, final)
+            if final:
+                return base + len(buffer)
+            carry = buffer[stop:]
+            base += stop
+
+    # same as Scanner.get_next_token, the value of keywords and symbols comes from the shared token
+    def get_next_token(self):
+        tk_type, value, self.start = next(self.tokens)
+        token = SHARED_TOKEN.get(tk_type)
+        if token is None:
+            return Token(tk_type, value)
+        return token
+
+
+# Nodes of the abstract syntax tree. The parser builds them once, so a loop body is scanned and parsed only one time
+# no matter how many times the loop runs
+class Program(object):
+    def __init__(self, name, declarations, block):
+        self.name = name
+        # list of Symbol in the order they were declared
+        self.declarations = declarations
+        self.block = block
+
+
+# A declared variable. The variables of each type are stored in their own array, slot is the index in that array
+class Symbol(object):
+    def __init__(self, name, var_type, slot):
+        self.name = name
+        self.var_type = var_type
+        self.slot = slot
+        self.real = var_type == 'REAL'
+
+
+# BEGIN ... END, a list of statements
+class Block(object):
+    def __init__(self, statements):
+        self.statements = statements
+
 
+# a := expr, symbol is None when a is not declared, pos is where the statement starts in the source
+class Assign(object):
+    def __init__(self, name, expr, symbol, pos):
+        self.name = name
+        self.expr = expr
+        self.symbol = symbol
+        self.pos = pos
 
-# Using the tokens from the scanner, we do actions accordingly using parser
+
+# REPEAT body UNTIL condition, pos is where the REPEAT starts in the source, the trace uses it as the jump address
+class Repeat(object):
+    def __init__(self, body, condition, pos):
+        self.body = body
+        self.condition = condition
+        self.pos = pos
+
+
+# the operator is stored as token type, e.g. TK_ADD, TK_DIV. real is the type of the result, set by check_types, and
+# shared is True when share_subexpressions found Shared nodes that use its value
+class BinOp(object):
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+        self.real = None
+        self.shared = False
+
+
+# unary + or -
+class UnaryOp(object):
+    def __init__(self, op, expr):
+        self.op = op
+        self.expr = expr
+        self.real = None
+        self.shared = False
+
+
+# Another use of the value of the operator node, which is computed before it in the same basic block, made by -O3.
+# The interpreter and the register code keep the value of node and use it again, the stack code computes it again
+class Shared(object):
+    def __init__(self, node):
+        self.node = node
+        self.real = node.real
+
+
+# only used by the UNTIL of a loop
+class Compare(object):
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+
+
+class Var(object):
+    def __init__(self, name, symbol):
+        self.name = name
+        self.symbol = symbol
+
+
+class Const(object):
+    def __init__(self, value):
+        self.value = value
+
+
+# Using the tokens from the scanner, we build the abstract syntax tree using parser
 class Parser(object):
 
     # initialization, also taking scanner as parameters so we can have access to get next token function
@@ -250,10 +460,9 @@ class Parser(object):
         self.curr_token = self.scanner.get_next_token()
         # symbol table is for storing data_types
         self.symbol_table = {}
-        # for storing actual value
-        self.memory_table = {}
-        self.ip = 0
-        self.code = []
+        # name -> Symbol, and how many slots each type has used so far
+        self.symbols = {}
+        self.slots = {'INTEGER': 0, 'REAL': 0}
 
     # 'eat' the current token, kind like the advance function in scanner, also return error if current token is not what
     # we  wanted to be
@@ -263,137 +472,71 @@ class Parser(object):
         else:
             raise Exception('"{token}" not match as intended, parsing error!'.format(token=self.curr_token.value))
 
-    # Push in real or int
-    def pushi(self):
-        self.code.append(str(One_Instruction('PUSHI', self.curr_token.value)))
-
-    # Push in variable
-    def push(self):
-        self.code.append(str(One_Instruction('PUSH', self.curr_token.value)))
-
-    # 'POP' from the stack
-    def pop(self):
-        self.code.append('<POP>')
-
-    # the deepest part in our grammar, always being executed first
-    def factor(self):
-        token = self.curr_token
-        # not adding or subtracting but for positive or negative, so each time we see '-' at factor level, we
-        # invert the value of the expression, each time we see positive, 'do nothing'
-        if token.tk_type == TK_ADD:
-            self.match(TK_ADD)
-            return +self.expr()
-        elif token.tk_type == TK_MINUS:
-            self.match(TK_MINUS)
-            result = self.expr()
-            self.code.append(str(One_Instruction('NEG', result)))
-            return -result
-        # return numbers for the calculations
-        elif token.tk_type == TK_INT_CONST:
-            self.pushi()
-            self.match(TK_INT_CONST)
-            return token.value
-        elif token.tk_type == TK_REAL_CONST:
-            self.pushi()
-            self.match(TK_REAL_CONST)
-            return token.value
-        # when we see (, we calculate the expression inside the parentheses first
-        elif token.tk_type == TK_LPR:
-            self.match(TK_LPR)
-            result = self.expr()
-            self.match(TK_RPR)
-            return result
-        # for accessing the value inside a variable
-        else:
-            self.push()
-            var = self.var()
-            result = self.memory_table.get(var.value)
-            if result is None:
-                raise Exception('"{var}" has not be declared or don"t have value assigned!'.format(var=var.value))
-            return result
-
-    # upper part in our grammar
-    def term(self):
-        # call factor before we calculate anything in terms
-        result = self.factor()
-        # perform mul or div or mod
-        while self.curr_token.tk_type in (TK_MUL, TK_DIV, TK_F_DIV, TK_MOD):
-            if self.curr_token.tk_type == TK_MUL:
-                self.match(TK_MUL)
-                factor = self.factor()
-                self.code.append(str(Two_Instruction('MUL', result, factor)))
-                self.pop()
-                result *= factor
-            elif self.curr_token.tk_type == TK_DIV:
-                self.match(TK_DIV)
-                factor = self.factor()
-                self.code.append(str(Two_Instruction('DIV', result, factor)))
-                self.pop()
-                result = int(result / factor)
-            elif self.curr_token.tk_type == TK_F_DIV:
-                self.match(TK_F_DIV)
-                factor = self.factor()
-                self.code.append(str(Two_Instruction('FDIV', result, factor)))
-                self.pop()
-                result = float(result / factor)
-            elif self.curr_token.tk_type == TK_MOD:
-                self.match(TK_MOD)
-                factor = self.factor()
-                self.code.append(str(Two_Instruction('MOD', result, factor)))
-                self.pop()
-                result %= factor
-        return result
-
-    # expression, 'highest' part of our grammar for arithmetic calculation
+    # An expression, with the precedence of the grammar
+    #   expr   : term (('+' | '-') term)*
+    #   term   : factor (('*' | DIV | '/' | '%') factor)*
+    #   factor : ('+' | '-') expr | '(' expr ')' | number | variable
+    # parsed with a loop and an explicit stack instead of python recursion, so the nesting of parentheses and signs is
+    # only limited by memory and the time is linear in the number of tokens. Every '(' and every sign opens a frame
+    # that holds the expr around it: the left operand and operator of the sum and of the product waiting for their
+    # right operand. A '(' frame ends at its ')', a sign applies to the whole expr after it, so its frame ends where
+    # the frame around it does. Operators of the same precedence group to the left, a - b - c is (a - b) - c
     def expr(self):
-        # call term first
-        result = self.term()
-        # add or subtract always perform last
-        while self.curr_token.tk_type in (TK_ADD, TK_MINUS):
-            if self.curr_token.tk_type == TK_ADD:
-                self.match(TK_ADD)
-                term = self.term()
-                self.code.append(str(Two_Instruction('ADD', result, term)))
-                self.pop()
-                result += term
-            elif self.curr_token.tk_type == TK_MINUS:
-                self.match(TK_MINUS)
-                term = self.term()
-                self.code.append(str(Two_Instruction('SUB', result, term)))
-                result -= term
-        return result
+        frames = []
+        # the frame being parsed, kind is TK_LPR, TK_ADD or TK_MINUS for a '(' or a sign and None for the outer one
+        kind = sum_left = sum_op = product_left = product_op = None
+        while True:
+            token = self.curr_token
+            # a '(' or a sign starts a new frame
+            if token.tk_type in (TK_LPR, TK_ADD, TK_MINUS):
+                self.match(token.tk_type)
+                frames.append((kind, sum_left, sum_op, product_left, product_op))
+                kind, sum_left, sum_op, product_left, product_op = token.tk_type, None, None, None, None
+                continue
+            # numbers for the calculations
+            if token.tk_type in (TK_INT_CONST, TK_REAL_CONST):
+                self.match(token.tk_type)
+                node = Const(token.value)
+            # for accessing the value inside a variable
+            else:
+                name = self.var().value
+                node = Var(name, self.symbols.get(name))
+            # node is a factor: finish the product and the sum it ends, and the frames that end after it
+            while True:
+                if product_op is not None:
+                    node = BinOp(product_op, product_left, node)
+                op = self.curr_token.tk_type
+                if op in (TK_MUL, TK_DIV, TK_F_DIV, TK_MOD):
+                    self.match(op)
+                    product_left, product_op = node, op
+                    break
+                if sum_op is not None:
+                    node = BinOp(sum_op, sum_left, node)
+                if op in (TK_ADD, TK_MINUS):
+                    self.match(op)
+                    sum_left, sum_op, product_op = node, op, None
+                    break
+                # the expr of the frame ends here
+                if kind is None:
+                    return node
+                if kind == TK_LPR:
+                    self.match(TK_RPR)
+                else:
+                    node = UnaryOp(kind, node)
+                # the frame is a factor of the one around it
+                kind, sum_left, sum_op, product_left, product_op = frames.pop()
 
     def comparison(self):
-        result = self.expr()
-        if self.curr_token.tk_type == TK_GREAT_THAN:
-            self.code.append(str(One_Instruction('JGE', self.ip)))
-            self.match(TK_GREAT_THAN)
-            return result >= self.expr()
-        elif self.curr_token.tk_type == TK_GREAT:
-            self.code.append(str(One_Instruction('JG', self.ip)))
-            self.match(TK_GREAT)
-            return result > self.expr()
-        elif self.curr_token.tk_type == TK_LESS_THAN:
-            self.code.append(str(One_Instruction('JLE', self.ip)))
-            self.match(TK_LESS_THAN)
-            return result <= self.expr()
-        elif self.curr_token.tk_type == TK_LESS:
-            self.code.append(str(One_Instruction('JL', self.ip)))
-            self.match(TK_LESS)
-            return result < self.expr()
-        elif self.curr_token.tk_type == TK_EQUAL:
-            self.code.append(str(One_Instruction('JE', self.ip)))
-            self.match(TK_EQUAL)
-            return result == self.expr()
-        elif self.curr_token.tk_type == TK_NOT_EQUAL:
-            self.code.append(str(One_Instruction('JNE', self.ip)))
-            self.match(TK_NOT_EQUAL)
-            return result != self.expr()
-
-    # when we returned a token, scanner.pos is where the token ended, so we want to go back to where the token started
-    # by subtract the token value from it.
-    def loop_pos(self):
-        return self.scanner.pos - len(self.curr_token.value)
+        left = self.expr()
+        op = self.curr_token.tk_type
+        if op not in COMPARE_OPS:
+            raise Exception('"{token}" is not a comparison, parsing error!'.format(token=self.curr_token.value))
+        self.match(op)
+        return Compare(op, left, self.expr())
+
+    # where the current token starts in the source
+    def token_pos(self):
+        return self.scanner.start
 
     # essentially to match the TK_ID and return the token for that id
     def var(self):
@@ -403,67 +546,59 @@ class Parser(object):
 
     # only called when we have an assignment
     def assignment(self):
+        pos = self.token_pos()
         left = self.var()  # token
         self.match(TK_ASSIGN)
-        right = self.expr()  # value of the token ( a:= expr)
-        # in Pascal, all the variables must be declared before assignment, so print a error message for that
-        if left.value not in self.symbol_table:
-            raise Exception('Variable "{name}" not declared before assignment!'.format(name=left.value))
-        # also, if the variable is assign to different type as declared, we return an error
-        elif self.check_type(self.symbol_table.get(left.value), right) is False:
-            raise Exception('Variable "{name}" is assigned to wrong type!'.format(name=left.value))
-        # token.value is the identifier, so we stored the token name and it's value as a pair in our memory
-        self.memory_table[left.value] = right
-        self.code.append(str(Two_Instruction('MOV', left, right)))
-
-    # a statement could be an assignment or another begin end blocks
+        return Assign(left.value, self.expr(), self.symbols.get(left.value), pos)
+
+    # a statement could be an assignment, a loop or another begin end blocks, returns None for the empty statement
     def statement(self):
         if self.curr_token.tk_type == TK_BEGIN:
-            self.begin_stat()
+            return self.begin_stat()
         elif self.curr_token.tk_type == TK_ID:
-            self.assignment()
+            return self.assignment()
         elif self.curr_token.tk_type == TK_REPEAT:
-            # Get the address for the jump, just before the repeat
-            self.ip = self.loop_pos()
-            self.code.append(str(Two_Instruction('MOV', '$ra', self.ip)))
-            self.repeat_statement()
+            return self.repeat_statement()
 
     #  loop
     def repeat_statement(self):
+        # Get the address of the repeat, for the jump in the trace
+        pos = self.token_pos()
         self.match(TK_REPEAT)
-        self.statement_list()
+        body = self.statement_list()
         self.match(TK_UNTIL)
-        # Save the comparison result
-        compare = self.comparison()
-        # If comparison returns false, jump back
-        if not compare:
-            self.curr_token = self.scanner.go_to(self.ip)
-            self.repeat_statement()
+        return Repeat(body, self.comparison(), pos)
 
     def statement_list(self):
-        self.statement()
-        # if their are multiple statements in one block, call all of them
-        while self.curr_token.tk_type == TK_SEMI:
+        statements = []
+        statement = self.statement()
+        # if their are multiple statements in one block, collect all of them
+        while True:
+            if statement is not None:
+                statements.append(statement)
+            if self.curr_token.tk_type != TK_SEMI:
+                return statements
             self.match(TK_SEMI)
-            self.statement()
+            statement = self.statement()
 
     # begin end block, each block could contain multiple statements so we use statement_list
     def begin_stat(self):
         self.match(TK_BEGIN)
-        self.statement_list()
+        statements = self.statement_list()
         self.match(TK_END)
+        return Block(statements)
 
     # for the declaration before the begin and end block, as all variable must be declared before assignment
     def declaration(self):
+        declarations = []
         if self.curr_token.tk_type == TK_VAR:
             self.match(TK_VAR)
             # loop until we go through all the declaration lines
             while self.curr_token.tk_type == TK_ID:
-                self.var_declare()
+                declarations.extend(self.var_declare())
                 self.match(TK_SEMI)
-            # if we don't see VAR, just skip the function
-        else:
-            pass
+        # if we don't see VAR, there is nothing declared
+        return declarations
 
     # declare variables
     # a : INTEGER
@@ -486,12 +621,17 @@ class Parser(object):
         # the type of variable
         right = self.type_declare()
         # adding those to symbol_table
+        declared = []
         for ID in variable:
             # in the form of a:INTEGER, and we could reassign value later
             if self.symbol_table.get(ID) is not None:
                 raise Exception('Variable "{name}" is duplicated!'.format(name=ID))
             self.symbol_table[ID] = right
-            self.code.append('{VAR}: .word {type}'.format(VAR=ID, type=right))
+            # each variable gets the next free slot of its type
+            self.symbols[ID] = Symbol(ID, right, self.slots[right])
+            self.slots[right] += 1
+            declared.append(self.symbols[ID])
+        return declared
 
     # Return the type according to tokens
     def type_declare(self):
@@ -503,36 +643,2134 @@ class Parser(object):
             self.match(TK_REAL)
             return 'REAL'
 
-    # Using the isinstance function to check if the variable and expression belong to same type
-    @staticmethod
-    def check_type(variable, expr):
-        if variable == 'INTEGER':
-            return isinstance(expr, int)
-        elif variable == 'REAL':
-            return isinstance(expr, float)
-
-    # main function
+    # main function, returns the Program node
     def program(self):
         # all program starts with PROGRAM id;
         self.match(TK_PROGRAM)
-        # store the program name into our table for later use (if any)
-        # name = self.curr_token.value
-        # self.symbol_table['Program_Name'] = name
-        self.match(TK_ID)
+        name = self.var().value
         self.match(TK_SEMI)
         # VAR block
-        self.declaration()
+        declarations = self.declaration()
         # Begin blocks
-        self.begin_stat()
+        block = self.begin_stat()
         # Match the dot for the end of program
         self.match(TK_DOT)
+        return Program(name, declarations, block)
 
 
-def main():
-    # Take in the input_file
-    with open('input_file','r') as input_file:
-        text = input_file.read()
-    text = str(text)
+# integer divide in pascal truncates, float divide always gives a REAL
+def int_div(left, right):
+    return int(left / right)
+
+
+# the function for each operator and comparison, / of two numbers is always a float in python
+BINARY_OPS = {TK_ADD: operator.add, TK_MINUS: operator.sub, TK_MUL: operator.mul,
+              TK_DIV: int_div, TK_F_DIV: operator.truediv, TK_MOD: operator.mod}
+COMPARE_OPS = {TK_GREAT_THAN: operator.ge, TK_GREAT: operator.gt, TK_LESS_THAN: operator.le,
+               TK_LESS: operator.lt, TK_EQUAL: operator.eq, TK_NOT_EQUAL: operator.ne}
+# the opcode of each operator in the trace, a comparison shows up as the jump with the same name
+TRACE_BINARY = {TK_ADD: OP_ADD, TK_MINUS: OP_SUB, TK_MUL: OP_MUL, TK_DIV: OP_DIV, TK_F_DIV: OP_F_DIV, TK_MOD: OP_MOD}
+TRACE_COMPARE = {TK_GREAT_THAN: OP_JGE, TK_GREAT: OP_JG, TK_LESS_THAN: OP_JLE,
+                 TK_LESS: OP_JL, TK_EQUAL: OP_JE, TK_NOT_EQUAL: OP_JNE}
+
+
+# Flatten an expression tree into a list with the operands before their operator, so the tree can be walked with a loop
+# and a value stack instead of python recursion. The nodes in leaves are kept without their operands
+def postfix(node, leaves=None):
+    result = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        result.append(node)
+        if leaves is not None and node in leaves:
+            continue
+        if isinstance(node, BinOp):
+            stack.append(node.left)
+            stack.append(node.right)
+        elif isinstance(node, UnaryOp):
+            stack.append(node.expr)
+    result.reverse()
+    return result
+
+
+# postfix with every Shared node replaced by the operators of its node, the expression before share_subexpressions
+def expanded_postfix(node):
+    result = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Shared):
+            node = node.node
+        result.append(node)
+        if isinstance(node, BinOp):
+            stack.append(node.left)
+            stack.append(node.right)
+        elif isinstance(node, UnaryOp):
+            stack.append(node.expr)
+    result.reverse()
+    return result
+
+
+# Every statement of a list, including the ones inside blocks and loops, in the order they appear in the source
+def walk_statements(statements):
+    stack = [iter(statements)]
+    while stack:
+        node = next(stack[-1], None)
+        if node is None:
+            stack.pop()
+            continue
+        yield node
+        if isinstance(node, Block):
+            stack.append(iter(node.statements))
+        elif isinstance(node, Repeat):
+            stack.append(iter(node.body))
+
+
+# Compute the parts of an expression that only use constants, e.g. 2 % 3 * 5 * (3+5) DIV 8 becomes 10. A division by
+# zero is left in the tree so it still fails when the program runs. Unary + is dropped as it does nothing
+def fold_expression(node):
+    values = []
+    for item in postfix(node):
+        if isinstance(item, UnaryOp):
+            operand = values.pop()
+            if item.op == TK_ADD:
+                values.append(operand)
+            elif isinstance(operand, Const):
+                values.append(Const(-operand.value))
+            else:
+                values.append(item if operand is item.expr else UnaryOp(item.op, operand))
+        elif isinstance(item, BinOp):
+            right = values.pop()
+            left = values.pop()
+            if isinstance(left, Const) and isinstance(right, Const):
+                try:
+                    values.append(Const(BINARY_OPS[item.op](left.value, right.value)))
+                    continue
+                except ZeroDivisionError:
+                    pass
+            values.append(item if left is item.left and right is item.right else BinOp(item.op, left, right))
+        else:
+            values.append(item)
+    return values[0]
+
+
+# -O1 on the tree: fold the constants of every expression in the program, returns how many expressions changed
+def fold_constants(program):
+    return fold_statements(program.block.statements)
+
+
+# The type of an expression, True for REAL, False for INTEGER and None when it uses an undeclared variable. Sets real
+# on its operators and adds the messages of its undeclared variables to errors
+def expression_type(node, errors):
+    types = []
+    for item in postfix(node):
+        if isinstance(item, Const):
+            types.append(type(item.value) is float)
+        elif isinstance(item, Var):
+            if item.symbol is None:
+                errors.append('"{var}" has not be declared or don"t have value assigned!'.format(var=item.name))
+                types.append(None)
+            else:
+                types.append(item.symbol.real)
+        elif isinstance(item, UnaryOp):
+            item.real = types[-1]
+        elif isinstance(item, Shared):
+            types.append(item.node.real)
+        else:
+            right = types.pop()
+            left = types[-1]
+            # / is always REAL and DIV always INTEGER, the others are REAL as soon as one side is
+            if item.op == TK_F_DIV:
+                real = True
+            elif item.op == TK_DIV:
+                real = False
+            elif left is None or right is None:
+                real = None
+            else:
+                real = left or right
+            item.real = types[-1] = real
+    return types[0]
+
+
+# Static type check of some statements and the ones inside them. Every variable is declared INTEGER or REAL, so the
+# type of every expression is known before the program runs. Returns the messages of all the undeclared variables and
+# wrong types, in the order they appear in the source and each one once
+def type_errors(statements):
+    errors = []
+    # (statements, loop) frames, the condition of a loop comes after its body
+    stack = [(iter(statements), None)]
+    while stack:
+        node = next(stack[-1][0], None)
+        if node is None:
+            loop = stack.pop()[1]
+            if loop is not None:
+                expression_type(loop.condition.left, errors)
+                expression_type(loop.condition.right, errors)
+        elif isinstance(node, Assign):
+            real = expression_type(node.expr, errors)
+            if node.symbol is None:
+                errors.append('Variable "{name}" not declared before assignment!'.format(name=node.name))
+            elif real is not None and real != node.symbol.real:
+                errors.append('Variable "{name}" is assigned to wrong type!'.format(name=node.name))
+        elif isinstance(node, Block):
+            stack.append((iter(node.statements), None))
+        else:
+            stack.append((iter(node.body), node))
+    return list(dict.fromkeys(errors))
+
+
+# Run the type check once, before the statements are interpreted or compiled, so the interpreter and the stack machine
+# do not check the type of every value they store. Raises one error with all the messages
+def check_types(statements):
+    errors = type_errors(statements)
+    if errors:
+        raise Exception('\n'.join(errors))
+
+
+# fold the expressions of some statements and the ones inside them, returns how many changed
+def fold_statements(statements):
+    changed = 0
+    for node in walk_statements(statements):
+        if isinstance(node, Assign):
+            expr = fold_expression(node.expr)
+            changed += expr is not node.expr
+            node.expr = expr
+        elif isinstance(node, Repeat):
+            for side in ('left', 'right'):
+                expr = fold_expression(getattr(node.condition, side))
+                changed += expr is not getattr(node.condition, side)
+                setattr(node.condition, side, expr)
+    return changed
+
+
+# the variables an expression reads
+def expression_reads(node):
+    return set(item.symbol for item in postfix(node) if isinstance(item, Var))
+
+
+# Whether an assignment can be left out when its value is never read: computing and storing the value can not fail.
+# That is a constant that fits the variable, a copy of a variable that already has a value, or + - * on REAL values,
+# which never raise. assigned has the variables with an assignment earlier in the source, only those have a value.
+# The constants are expected to be folded already, 5 * 5 is not seen as a constant
+def removable(node, assigned):
+    expr = node.expr
+    if isinstance(expr, Const):
+        return node.symbol.real or -0x8000000000000000 <= expr.value <= 0x7fffffffffffffff
+    if isinstance(expr, Var):
+        return expr.symbol in assigned
+    for item in postfix(expr):
+        if isinstance(item, Var):
+            if not item.symbol.real or item.symbol not in assigned:
+                return False
+        elif isinstance(item, Const):
+            if type(item.value) is not float and not -0x8000000000000000 <= item.value <= 0x7fffffffffffffff:
+                return False
+        elif isinstance(item, BinOp) and item.op not in (TK_ADD, TK_MINUS, TK_MUL):
+            return False
+    return True
+
+
+# Backward liveness over some statements: live is the set of variables read later, returns the set read before they run.
+# reads has the variables read by every assignment and loop condition. An assignment in removable whose variable is not
+# live after it is marked in dead, and is then no use to the variables it reads. A loop goes round until the set at the
+# top of its body stops growing, the body runs again after the condition, so the top is live at the end of the body too.
+# tops keeps the set of every loop between calls, it only grows, so an inner loop starts from where it stopped the last
+# time around the outer one
+def live_variables(statements, live, reads, removable, dead, tops):
+    for node in reversed(statements):
+        if isinstance(node, Assign):
+            dead[node] = node.symbol not in live and node in removable
+            if not dead[node]:
+                live = (live - {node.symbol}) | reads[node]
+        elif isinstance(node, Block):
+            live = live_variables(node.statements, live, reads, removable, dead, tops)
+        else:
+            end = live | reads[node]
+            top = tops.get(node, frozenset())
+            while True:
+                new = live_variables(node.body, end | top, reads, removable, dead, tops)
+                if new == top:
+                    break
+                top = new
+            tops[node] = top
+            live = top
+    return live
+
+
+# -O2 on the tree, after fold_constants: remove the assignments whose value is never read, then the variables that are
+# not used at all. All the variables are live at the end, the memory table shows them. An assignment that could fail
+# is kept, so the program still stops with the same error. Returns the removed assignments and declarations
+def eliminate_dead_code(program):
+    statements = program.block.statements
+    check_types(statements)
+    assigned, candidates, reads = set(), set(), {}
+    for node in walk_statements(statements):
+        if isinstance(node, Assign):
+            reads[node] = expression_reads(node.expr)
+            if removable(node, assigned):
+                candidates.add(node)
+            assigned.add(node.symbol)
+        elif isinstance(node, Repeat):
+            reads[node] = expression_reads(node.condition.left) | expression_reads(node.condition.right)
+    dead = {}
+    live_variables(statements, frozenset(program.declarations), reads, candidates, dead, {})
+    removed = [node for node in walk_statements(statements) if dead.get(node)]
+    lists = [statements] + [node.statements if isinstance(node, Block) else node.body
+                            for node in walk_statements(statements) if not isinstance(node, Assign)]
+    for body in lists:
+        body[:] = [node for node in body if not dead.get(node)]
+    used = set()
+    for node, variables in reads.items():
+        if not dead.get(node):
+            used |= variables
+            if isinstance(node, Assign):
+                used.add(node.symbol)
+    unused = [symbol for symbol in program.declarations if symbol not in used]
+    # the slots of the variables that are left are numbered again
+    program.declarations[:] = [symbol for symbol in program.declarations if symbol in used]
+    slots = {'INTEGER': 0, 'REAL': 0}
+    for symbol in program.declarations:
+        symbol.slot = slots[symbol.var_type]
+        slots[symbol.var_type] += 1
+    return removed, unused
+
+
+# Value numbering of one expression for share_subexpressions. table maps a constant, a variable or an operator on the
+# numbers of its operands to (number, node), every operator that is already in it is replaced by a Shared of its node.
+# A variable is numbered with the assignments to it so far in versions, so an operator that reads a variable assigned
+# since is not matched. Returns the new expression, how many Shared nodes it has and how many operators they replaced
+def share_expression(node, table, versions):
+    # (node, number, operators computed by node) of the operands on the stack
+    values = []
+    saved = 0
+    for item in postfix(node):
+        if isinstance(item, Const):
+            value = item.value
+            key = (type(value), value if type(value) is int else repr(value))
+            values.append((item, table.setdefault(key, (len(table), None))[0], 0))
+        elif isinstance(item, Var):
+            key = (item.symbol, versions.get(item.symbol, 0))
+            values.append((item, table.setdefault(key, (len(table), None))[0], 0))
+        elif isinstance(item, UnaryOp) and item.op == TK_ADD:
+            # unary + is its operand
+            continue
+        else:
+            count = 1 if isinstance(item, UnaryOp) else 2
+            operands = values[-count:]
+            del values[-count:]
+            key = (item.op, count) + tuple(number for _, number, _ in operands)
+            cost = 1 + sum(cost for _, _, cost in operands)
+            found = table.get(key)
+            if found is not None:
+                saved += cost
+                values.append((Shared(found[1]), found[0], 0))
+                continue
+            if count == 1:
+                new = item if operands[0][0] is item.expr else UnaryOp(item.op, operands[0][0])
+            elif operands[0][0] is item.left and operands[1][0] is item.right:
+                new = item
+            else:
+                new = BinOp(item.op, operands[0][0], operands[1][0])
+            new.real = item.real
+            table[key] = (len(table), new)
+            values.append((new, len(table) - 1, cost))
+    node = values[0][0]
+    shared = 0
+    for item in postfix(node):
+        if isinstance(item, Shared):
+            item.node.shared = True
+            shared += 1
+    return node, shared, saved
+
+
+# -O3 on the tree, after eliminate_dead_code: common subexpression elimination. A basic block is a stretch of code that
+# runs from its start to its end without a jump in or out, the top of a loop and the code after its condition start new
+# ones. In a block, an operator that computes again what an operator before it computed, from variables that were not
+# assigned in between, is replaced by a Shared of that one. Returns how many Shared nodes were made and how many
+# operators they replaced
+def share_subexpressions(program):
+    shared = saved = 0
+    table, versions = {}, {}
+    # (statements, loop) frames like type_errors, the condition of a loop ends the last block of its body
+    stack = [(iter(program.block.statements), None)]
+    while stack:
+        node = next(stack[-1][0], None)
+        if node is None:
+            loop = stack.pop()[1]
+            if loop is not None:
+                condition = loop.condition
+                condition.left, uses, operators = share_expression(condition.left, table, versions)
+                shared, saved = shared + uses, saved + operators
+                condition.right, uses, operators = share_expression(condition.right, table, versions)
+                shared, saved = shared + uses, saved + operators
+                table = {}
+        elif isinstance(node, Assign):
+            node.expr, uses, operators = share_expression(node.expr, table, versions)
+            shared, saved = shared + uses, saved + operators
+            versions[node.symbol] = versions.get(node.symbol, 0) + 1
+        elif isinstance(node, Block):
+            stack.append((iter(node.statements), None))
+        else:
+            table = {}
+            stack.append((iter(node.body), node))
+    return shared, saved
+
+
+# the -O levels
+OPTIMIZE_LEVELS = (0, 1, 2, 3)
+
+
+# The passes on the tree for an -O level: 1 folds the constants, 2 also removes dead assignments and unused variables
+# and 3 also shares the common subexpressions, RegisterGenerator optimizes the loops at that level too. Returns what
+# the passes found by name, for optimize_report
+def optimize_program(program, optimize):
+    report = {}
+    if optimize >= 1:
+        fold_constants(program)
+    if optimize >= 2:
+        report['dead_code'] = eliminate_dead_code(program)
+    if optimize >= 3:
+        report['shared'] = share_subexpressions(program)
+    return report
+
+
+# Storage for the variables of a program. INTEGER and REAL variables live in two typed arrays and are read and written
+# by their slot instead of by name. Each array has a flag per slot that is set once the variable has a value
+class Memory(object):
+
+    def __init__(self, symbols):
+        self.symbols = symbols
+        ints = sum(1 for symbol in symbols if not symbol.real)
+        reals = len(symbols) - ints
+        self.ints = array('q', bytes(8 * ints))
+        self.reals = array('d', bytes(8 * reals))
+        self.int_set = bytearray(ints)
+        self.real_set = bytearray(reals)
+
+    def load(self, symbol):
+        if symbol.real:
+            if self.real_set[symbol.slot]:
+                return self.reals[symbol.slot]
+        elif self.int_set[symbol.slot]:
+            return self.ints[symbol.slot]
+        raise Exception('"{var}" has not be declared or don"t have value assigned!'.format(var=symbol.name))
+
+    # the value must already have the right type
+    def store(self, symbol, value):
+        if symbol.real:
+            self.reals[symbol.slot] = value
+            self.real_set[symbol.slot] = 1
+        else:
+            try:
+                self.ints[symbol.slot] = value
+            except OverflowError:
+                raise Exception('Variable "{name}" is out of the INTEGER range!'.format(name=symbol.name))
+            self.int_set[symbol.slot] = 1
+
+    # rebuild the name -> value memory_table of the variables that have a value, for printing
+    def table(self):
+        table = {}
+        for symbol in self.symbols:
+            if symbol.real and self.real_set[symbol.slot]:
+                table[symbol.name] = self.reals[symbol.slot]
+            elif not symbol.real and self.int_set[symbol.slot]:
+                table[symbol.name] = self.ints[symbol.slot]
+        return table
+
+
+# How each instruction of the trace is written in simple_stack, {0} and {1} are its operands
+TRACE_TEMPLATES = {OP_WORD: '{0}: .word {1}', OP_POP: '<POP>', OP_PUSH_INT: '< PUSH {0} >', OP_PUSHI: '< PUSHI {0} >',
+                   OP_NEG: '< NEG {0} >', OP_MOV_INT: '< MOV {0} {1} >', OP_ADD: '< ADD {0} {1} >',
+                   OP_SUB: '< SUB {0} {1} >', OP_MUL: '< MUL {0} {1} >', OP_DIV: '< DIV {0} {1} >',
+                   OP_F_DIV: '< FDIV {0} {1} >', OP_MOD: '< MOD {0} {1} >', OP_JG: '< JG {0} >', OP_JGE: '< JGE {0} >',
+                   OP_JL: '< JL {0} >', OP_JLE: '< JLE {0} >', OP_JE: '< JE {0} >', OP_JNE: '< JNE {0} >'}
+TRACE_RENDER = dict((op, template.format) for op, template in TRACE_TEMPLATES.items())
+# instructions kept before a Trace with a sink renders them and passes them on
+TRACE_CHUNK = 1 << 16
+
+
+# The instructions of the interpreter in three parallel arrays: the opcode and the two operands, the names and values
+# the text shows. The text is only made when the trace is read, e.g. when simple_stack is written. With a sink, the
+# interpreter hands the rendered instructions to sink.extend every TRACE_CHUNK instructions and the arrays start over
+class Trace(object):
+
+    def __init__(self, sink=None):
+        self.ops = array('B')
+        self.first = []
+        self.second = []
+        self.sink = sink
+        # instructions already handed to the sink
+        self.flushed = 0
+
+    def __len__(self):
+        return len(self.ops)
+
+    # every instruction emitted so far, flushed or not
+    @property
+    def size(self):
+        return self.flushed + len(self.ops)
+
+    # the text of the instructions
+    def __iter__(self):
+        render = TRACE_RENDER
+        for op, first, second in zip(self.ops, self.first, self.second):
+            yield render[op](first, second)
+
+    def emit(self, op, first=None, second=None):
+        self.ops.append(op)
+        self.first.append(first)
+        self.second.append(second)
+
+    def flush(self):
+        if self.sink is not None:
+            self.sink.extend(self)
+            self.flushed += len(self.ops)
+            del self.ops[:], self.first[:], self.second[:]
+
+
+# loop iterations between two checks of the iterations of a Budget
+BUDGET_INTERVAL = 1024
+# statements of the interpreter or instructions of a machine between two looks at the clock and the size of the trace
+BUDGET_STEPS = 1024
+# what the limits of a Budget count, for the messages
+BUDGET_NAMES = {'iterations': 'loop iterations', 'seconds': 'seconds', 'trace': 'trace instructions'}
+
+
+# A run of a program went over its Budget. limit is 'iterations', 'seconds' or 'trace', stats has how far the run
+# got: the loop iterations, the seconds and the instructions of the trace
+class BudgetExceeded(Exception):
+
+    def __init__(self, limit, stats):
+        Exception.__init__(self, 'Budget exceeded: more than {value} {limit}! ({stats})'.format(
+            value=stats['budget'][limit], limit=BUDGET_NAMES[limit], stats=', '.join(
+                '{value} {name}'.format(value=round(stats[name], 3), name=BUDGET_NAMES[name])
+                for name in ('iterations', 'seconds', 'trace'))))
+        self.limit = limit
+        self.stats = stats
+
+
+# Limits for one run of a program, None is no limit: how many times the loops may go back to their top, the wall clock
+# seconds from the start of the run and the number of instructions in the trace of the interpreter. A machine only
+# counts down two ints and calls the Budget when one gets to 0, so the budget costs next to nothing when it is always
+# on: the iterations at every jump back, they are exact and checked by check, and the statements or instructions it
+# ran, the clock and the trace are looked at by look every BUDGET_STEPS of them and whenever the trace is flushed
+class Budget(object):
+
+    def __init__(self, iterations=None, seconds=None, trace=None):
+        self.iterations = iterations
+        self.seconds = seconds
+        self.trace = trace
+        # iterations counted at the checks so far, and how many the machine got at the last one
+        self.used = 0
+        self.given = 0
+        self.started = None
+
+    # a new Budget with the same limits, for another run
+    def renew(self):
+        return Budget(self.iterations, self.seconds, self.trace)
+
+    # called when the run starts, returns the iterations the machine counts down before the first check
+    def start(self):
+        self.started = time.perf_counter()
+        return self.refuel()
+
+    def refuel(self):
+        self.given = BUDGET_INTERVAL
+        if self.iterations is not None:
+            self.given = min(self.given, self.iterations - self.used + 1)
+        return self.given
+
+    # the machine used up the iterations it got, trace is the size of its trace. Raises BudgetExceeded or gives more
+    # iterations
+    def check(self, trace=0):
+        self.used += self.given
+        # the jump that made the check does not happen
+        if self.iterations is not None and self.used > self.iterations:
+            self.exceeded('iterations', self.used - 1, time.perf_counter() - self.started, trace)
+        self.limits(self.used - 1, trace)
+        return self.refuel()
+
+    # the machine ran BUDGET_STEPS statements or instructions or flushed its trace with fuel iterations left. Raises
+    # BudgetExceeded or gives more steps
+    def look(self, fuel, trace=0):
+        self.limits(self.used + self.given - fuel, trace)
+        return BUDGET_STEPS
+
+    # the clock and the trace, after the given number of iterations
+    def limits(self, iterations, trace):
+        seconds = time.perf_counter() - self.started
+        if self.seconds is not None and seconds > self.seconds:
+            self.exceeded('seconds', iterations, seconds, trace)
+        if self.trace is not None and trace > self.trace:
+            self.exceeded('trace', iterations, seconds, trace)
+
+    def exceeded(self, limit, iterations, seconds, trace):
+        raise BudgetExceeded(limit, {'iterations': iterations, 'seconds': seconds, 'trace': trace, 'budget': {
+                                         'iterations': self.iterations, 'seconds': self.seconds,
+                                         'trace': self.trace}})
+
+
+# Walk the tree the parser built and run the program, the nodes of a loop body are simply visited again for every
+# iteration. Also records the trace of stack instructions that the program executed
+class Interpreter(object):
+
+    # the instructions are kept in a Trace, with a sink like a TraceWriter they are passed on to it as the program runs
+    def __init__(self, program, sink=None, budget=None):
+        self.program = program
+        self.budget = budget if budget is not None else Budget()
+        self.symbol_table = {}
+        # for storing actual value
+        self.memory = Memory(program.declarations)
+        self.code = Trace(sink)
+        # the types are checked once here, the values are stored without looking at their type
+        check_types(program.block.statements)
+        # expressions are flattened once and reused on every visit
+        self.postfix_cache = {}
+        # the last value of every operator that Shared nodes use
+        self.shared = {}
+
+    # the values of the variables by name
+    @property
+    def memory_table(self):
+        return self.memory.table()
+
+    # Evaluate an expression with a value stack, emitting the same instructions the parser used to emit
+    def evaluate(self, node):
+        items = self.postfix_cache.get(node)
+        if items is None:
+            items = self.postfix_cache[node] = postfix(node)
+        code = self.code
+        ops, first, second = code.ops.append, code.first.append, code.second.append
+        values = []
+        for item in items:
+            if isinstance(item, Const):
+                ops(OP_PUSHI)
+                first(item.value)
+                second(None)
+                values.append(item.value)
+            elif isinstance(item, Var):
+                ops(OP_PUSH_INT)
+                first(item.name)
+                second(None)
+                values.append(self.memory.load(item.symbol))
+            elif isinstance(item, UnaryOp):
+                if item.op == TK_MINUS:
+                    ops(OP_NEG)
+                    first(values[-1])
+                    second(None)
+                    values[-1] = -values[-1]
+                if item.shared:
+                    self.shared[item] = values[-1]
+            elif isinstance(item, Shared):
+                # the value is known, the trace shows it pushed like a constant
+                ops(OP_PUSHI)
+                first(self.shared[item.node])
+                second(None)
+                values.append(self.shared[item.node])
+            else:
+                right = values.pop()
+                left = values[-1]
+                ops(TRACE_BINARY[item.op])
+                first(left)
+                second(right)
+                # the trace never had a POP after SUB, keep it the same
+                if item.op != TK_MINUS:
+                    self.pop()
+                values[-1] = BINARY_OPS[item.op](left, right)
+                if item.shared:
+                    self.shared[item] = values[-1]
+        return values[0]
+
+    # 'POP' from the stack
+    def pop(self):
+        self.code.emit(OP_POP)
+
+    # the condition at the end of a loop, the jump goes back to where the REPEAT started
+    def comparison(self, node, pos):
+        left = self.evaluate(node.left)
+        self.code.emit(TRACE_COMPARE[node.op], pos)
+        return COMPARE_OPS[node.op](left, self.evaluate(node.right))
+
+    def assignment(self, node):
+        right = self.evaluate(node.expr)
+        # store the value in the slot of the variable, check_types made sure it is declared and has its type
+        self.memory.store(node.symbol, right)
+        self.code.emit(OP_MOV_INT, node.name, right)
+
+    # main function, blocks and loops are kept on an explicit stack of [statements, index, loop] frames, so the depth
+    # of python calls does not grow with the number of iterations
+    def run(self):
+        code = self.code
+        for symbol in self.program.declarations:
+            self.symbol_table[symbol.name] = symbol.var_type
+            code.emit(OP_WORD, symbol.name, symbol.var_type)
+        # with a sink, the trace is passed on every TRACE_CHUNK instructions
+        chunk = TRACE_CHUNK if code.sink is not None else None
+        budget = self.budget
+        fuel = budget.start()
+        steps = BUDGET_STEPS
+        stack = [[self.program.block.statements, 0, None]]
+        while stack:
+            frame = stack[-1]
+            statements, index, loop = frame
+            if index < len(statements):
+                steps -= 1
+                if not steps:
+                    steps = budget.look(fuel, code.size)
+                if chunk is not None and len(code.ops) >= chunk:
+                    # a trace that is over the budget is not passed on
+                    steps = budget.look(fuel, code.size)
+                    code.flush()
+                frame[1] = index + 1
+                node = statements[index]
+                if isinstance(node, Assign):
+                    self.assignment(node)
+                elif isinstance(node, Block):
+                    stack.append([node.statements, 0, None])
+                else:
+                    code.emit(OP_MOV_INT, '$ra', node.pos)
+                    stack.append([node.body, 0, node])
+            # end of a loop body, if the comparison returns false, jump back
+            elif loop is not None and not self.comparison(loop.condition, loop.pos):
+                frame[1] = 0
+                fuel -= 1
+                if not fuel:
+                    fuel = budget.check(code.size)
+            else:
+                stack.pop()
+        code.flush()
+
+
+# the opcode for each operator, and the jump that goes back to the top of a loop when the UNTIL condition is false
+BINARY_OPCODES = {TK_ADD: OP_ADD, TK_MINUS: OP_SUB, TK_MUL: OP_MUL, TK_DIV: OP_DIV, TK_F_DIV: OP_F_DIV, TK_MOD: OP_MOD}
+LOOP_JUMPS = {TK_GREAT_THAN: OP_JL, TK_GREAT: OP_JLE, TK_LESS_THAN: OP_JG,
+              TK_LESS: OP_JGE, TK_EQUAL: OP_JNE, TK_NOT_EQUAL: OP_JE}
+OP_NAMES = {OP_PUSH_INT: 'PUSH', OP_PUSH_REAL: 'PUSH', OP_PUSHI: 'PUSHI', OP_MOV_INT: 'MOV', OP_MOV_REAL: 'MOV',
+            OP_ADD: 'ADD', OP_SUB: 'SUB', OP_MUL: 'MUL',
+            OP_DIV: 'DIV', OP_F_DIV: 'F_DIV', OP_MOD: 'MOD', OP_NEG: 'NEG', OP_JG: 'JG', OP_JGE: 'JGE',
+            OP_JL: 'JL', OP_JLE: 'JLE', OP_JE: 'JE', OP_JNE: 'JNE', OP_COUNT: 'COUNT'}
+JUMPS = (OP_JG, OP_JGE, OP_JL, OP_JLE, OP_JE, OP_JNE)
+# the names of the instructions in the trace
+TRACE_NAMES = dict(OP_NAMES)
+TRACE_NAMES.update({OP_F_DIV: 'FDIV', OP_POP: 'POP', OP_WORD: '.word'})
+# the binary opcodes and what they compute, for folding constants in the code
+BINARY_FOLDS = dict((BINARY_OPCODES[op], BINARY_OPS[op]) for op in BINARY_OPCODES)
+
+
+# The compiled program: the declarations, the opcodes and their arguments in two parallel lists, and the constants
+# PUSHI refers to. PUSH and MOV take the slot of the variable, jumps take the index of the instruction to jump to
+class StackCode(object):
+    def __init__(self, declarations, ops, args, consts):
+        self.declarations = declarations
+        self.ops = ops
+        self.args = args
+        self.consts = consts
+        # jump pc -> the python function of a hot loop, or None when it could not be translated
+        self.compiled = {}
+
+    # the names of the INTEGER slots and of the REAL slots
+    def slot_names(self):
+        names = ([], [])
+        for symbol in self.declarations:
+            names[symbol.real].append(symbol.name)
+        return names
+
+    # the text form written to simple_stack, with a label in front of every jump target. Variables are shown by name,
+    # the COUNTs of a profile are left out so the listing is the same as without --profile
+    def listing(self):
+        lines = ['{VAR}: .word {type}'.format(VAR=symbol.name, type=symbol.var_type) for symbol in self.declarations]
+        int_names, real_names = self.slot_names()
+        labels = {}
+        for op, arg in zip(self.ops, self.args):
+            if op in JUMPS and arg not in labels:
+                labels[arg] = 'L{n}'.format(n=len(labels))
+        for pc, (op, arg) in enumerate(zip(self.ops, self.args)):
+            if pc in labels:
+                lines.append('{label}:'.format(label=labels[pc]))
+            if op == OP_COUNT:
+                continue
+            if op == OP_PUSHI:
+                lines.append(str(One_Instruction('PUSHI', self.consts[arg])))
+            elif op in JUMPS:
+                lines.append(str(One_Instruction(OP_NAMES[op], labels[arg])))
+            elif op in (OP_PUSH_INT, OP_MOV_INT):
+                lines.append(str(One_Instruction(OP_NAMES[op], int_names[arg])))
+            elif op in (OP_PUSH_REAL, OP_MOV_REAL):
+                lines.append(str(One_Instruction(OP_NAMES[op], real_names[arg])))
+            else:
+                lines.append('< {ins} >'.format(ins=OP_NAMES[op]))
+        if len(self.ops) in labels:
+            lines.append('{label}:'.format(label=labels[len(self.ops)]))
+        return lines
+
+
+# the formats simple_stack can be written in
+TRACE_FORMATS = ('json', 'lines')
+# bytes buffered before a TraceWriter writes to the file
+TRACE_BUFFER = 1 << 20
+# the string encoder json.dump uses
+encode_string = json.encoder.encode_basestring_ascii
+
+
+# Writes the instructions to a file as they are made, so a long loop does not keep millions of strings in memory until
+# the end. 'json' gives the same file as json.dump(instructions, indent=2), 'lines' is one instruction per line with
+# no quotes, smaller and quicker to write. The file is written under another name first and only replaces path when
+# close() is called, so a program that fails leaves the old file alone, like the list did
+class TraceWriter(object):
+
+    def __init__(self, path, format='json'):
+        if format not in TRACE_FORMATS:
+            raise Exception('Unknown trace format "{format}"!'.format(format=format))
+        self.path = path
+        self.temp = '{path}.{pid}.tmp'.format(path=path, pid=os.getpid())
+        self.file = open(self.temp, 'w', buffering=TRACE_BUFFER)
+        self.write = self.file.write
+        self.json = format == 'json'
+        self.count = 0
+        # what goes in front of the next instruction in json
+        self.separator = '\n  '
+        if self.json:
+            self.write('[')
+
+    def append(self, line):
+        if self.json:
+            self.write(self.separator + encode_string(line))
+            self.separator = ',\n  '
+        else:
+            self.write(line + '\n')
+        self.count += 1
+
+    # TRACE_CHUNK instructions at a time are joined before they are written
+    def extend(self, lines):
+        lines = iter(lines)
+        while True:
+            chunk = list(itertools.islice(lines, TRACE_CHUNK))
+            if not chunk:
+                return
+            if self.json:
+                self.write(self.separator + ',\n  '.join(map(encode_string, chunk)))
+                self.separator = ',\n  '
+            else:
+                self.write('\n'.join(chunk) + '\n')
+            self.count += len(chunk)
+
+    def close(self):
+        if self.json:
+            self.file.write('\n]' if self.count else ']')
+        self.file.close()
+        os.replace(self.temp, self.path)
+
+    def discard(self):
+        self.file.close()
+        os.remove(self.temp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, error, traceback):
+        if kind is None:
+            self.close()
+        else:
+            self.discard()
+
+
+# write a list of instructions to path in one of the TRACE_FORMATS
+def write_trace(path, lines, format='json'):
+    with TraceWriter(path, format) as writer:
+        writer.extend(lines)
+
+
+# Translate the tree into stack machine code. Every statement is emitted once, a loop becomes a label and a conditional
+# jump back to it, so the size of the code does not depend on how many times the loops run
+class CodeGenerator(object):
+
+    def __init__(self, program, optimize=0, profile=None):
+        self.program = program
+        self.optimize = optimize
+        # when profiling, a COUNT is emitted in front of every assignment and at the end of every loop body
+        self.profile = profile
+        self.ops = []
+        self.args = []
+        self.consts = []
+        self.const_index = {}
+        self.labels = 0
+
+    def emit(self, op, arg=None):
+        self.ops.append(op)
+        self.args.append(arg)
+
+    # constants are kept in a pool, PUSHI takes the index. The type is part of the key so 1 and 1.0 stay different
+    def constant(self, value):
+        key = (type(value), value)
+        index = self.const_index.get(key)
+        if index is None:
+            index = self.const_index[key] = len(self.consts)
+            self.consts.append(value)
+        return index
+
+    def new_label(self):
+        self.labels += 1
+        return self.labels - 1
+
+    # the stack machine has nowhere to keep a value but the variables, so a Shared node is computed again
+    def expression(self, node):
+        for item in expanded_postfix(node):
+            if isinstance(item, Const):
+                self.emit(OP_PUSHI, self.constant(item.value))
+            elif isinstance(item, Var):
+                self.emit(OP_PUSH_REAL if item.symbol.real else OP_PUSH_INT, item.symbol.slot)
+            elif isinstance(item, UnaryOp):
+                if item.op == TK_MINUS:
+                    self.emit(OP_NEG)
+            else:
+                self.emit(BINARY_OPCODES[item.op])
+
+    def statements(self, statements):
+        for node in statements:
+            if isinstance(node, Assign):
+                if self.profile is not None:
+                    self.emit(OP_COUNT, self.profile.counter(node))
+                self.expression(node.expr)
+                self.emit(OP_MOV_REAL if node.symbol.real else OP_MOV_INT, node.symbol.slot)
+            elif isinstance(node, Block):
+                self.statements(node.statements)
+            else:
+                # REPEAT body UNTIL left op right: jump back to the top while the condition is false
+                top = self.new_label()
+                self.emit(OP_LABEL, top)
+                self.statements(node.body)
+                if self.profile is not None:
+                    self.emit(OP_COUNT, self.profile.counter(node))
+                self.expression(node.condition.left)
+                self.expression(node.condition.right)
+                self.emit(LOOP_JUMPS[node.condition.op], top)
+
+    # remove the labels and point the jumps at the instruction after them
+    def resolve(self):
+        ops, args, targets = [], [], {}
+        for op, arg in zip(self.ops, self.args):
+            if op == OP_LABEL:
+                targets[arg] = len(ops)
+            else:
+                ops.append(op)
+                args.append(arg)
+        for pc, op in enumerate(ops):
+            if op in JUMPS:
+                args[pc] = targets[args[pc]]
+        return ops, args
+
+    # -O1 on the code: look at the last few instructions every time one is added and replace them with fewer ones.
+    # Labels are never moved or removed, so nothing is combined across a jump target
+    def peephole(self):
+        ops, args = [], []
+        # (MOV opcode, slot) of the variables with a MOV earlier in the code. There are only backward jumps, so
+        # everything before an instruction has run at least once when it runs, and these variables have a value
+        stored = set()
+        for op, arg in zip(self.ops, self.args):
+            ops.append(op)
+            args.append(arg)
+            while len(ops) >= 2:
+                last, before = ops[-1], ops[-2]
+                # PUSHI a PUSHI b ADD -> PUSHI a+b, same for the other operators
+                if last in BINARY_FOLDS and before == OP_PUSHI and len(ops) >= 3 and ops[-3] == OP_PUSHI:
+                    try:
+                        value = BINARY_FOLDS[last](self.consts[args[-3]], self.consts[args[-2]])
+                    except ZeroDivisionError:
+                        break
+                    del ops[-2:], args[-2:]
+                    args[-1] = self.constant(value)
+                # PUSHI 5 NEG -> PUSHI -5
+                elif last == OP_NEG and before == OP_PUSHI:
+                    ops.pop()
+                    args.pop()
+                    args[-1] = self.constant(-self.consts[args[-1]])
+                # NEG NEG does nothing, NEG ADD is SUB and NEG SUB is ADD
+                elif before == OP_NEG and last in (OP_NEG, OP_ADD, OP_SUB):
+                    del ops[-2:], args[-2:]
+                    if last != OP_NEG:
+                        ops.append(OP_SUB if last == OP_ADD else OP_ADD)
+                        args.append(None)
+                # multiplying by the integer 1 does nothing
+                elif last == OP_MUL and before == OP_PUSHI and type(self.consts[args[-2]]) is int \
+                        and self.consts[args[-2]] == 1:
+                    del ops[-2:], args[-2:]
+                # PUSH a MOV a, a := a, is a push and pop that change nothing once a has a value
+                elif (before, last) in ((OP_PUSH_INT, OP_MOV_INT), (OP_PUSH_REAL, OP_MOV_REAL)) \
+                        and args[-1] == args[-2] and (last, args[-1]) in stored:
+                    del ops[-2:], args[-2:]
+                else:
+                    break
+            if op in (OP_MOV_INT, OP_MOV_REAL):
+                stored.add((op, arg))
+        self.ops, self.args = ops, args
+
+    # main function, returns the StackCode of the program
+    def generate(self):
+        check_types(self.program.block.statements)
+        self.statements(self.program.block.statements)
+        if self.optimize >= 1:
+            self.peephole()
+        ops, args = self.resolve()
+        return StackCode(list(self.program.declarations), ops, args, self.consts)
+
+
+# python operators of the jumps, for translating loops
+JUMP_OPERATORS = {OP_JG: '>', OP_JGE: '>=', OP_JL: '<', OP_JLE: '<=', OP_JE: '==', OP_JNE: '!='}
+# loop iterations the stack machine runs before it translates the loop into python
+TIER_THRESHOLD = 200
+
+
+# Translate the loop of code from top to the jump at the end of it into the source of a python function
+# loop(ints, reals, counters, consts, fuel, steps, check, look) that runs it until it exits. fuel, steps, check and look
+# are those of the Budget of the machine, what is left of fuel and steps is returned. The variables are locals while it
+# runs and are written back to the memory when it returns or fails. It is only called after the loop went around once,
+# so every variable it uses has a value and that check is left out; the INTEGER range of a store and the errors of the
+# operators are the same as in the machine. Returns None for code it can not translate
+def translate_loop(code, top, jump):
+    ops, args, consts = code.ops, code.args, code.consts
+    int_names, real_names = code.slot_names()
+    # how many loops start at each pc, a loop starts where its jump goes back to
+    starts = {}
+    for pc in range(top, jump + 1):
+        if ops[pc] in JUMPS:
+            if not top <= args[pc] <= pc:
+                return None
+            starts[args[pc]] = starts.get(args[pc], 0) + 1
+    lines = []
+    indent = 1
+    stack = []
+    loaded, stored = set(), set()
+    for pc in range(top, jump + 1):
+        op, arg = ops[pc], args[pc]
+        if pc in starts:
+            if stack:
+                return None
+            for _ in range(starts[pc]):
+                lines.append('    ' * indent + 'while True:')
+                indent += 1
+        if op == OP_PUSH_INT or op == OP_PUSH_REAL:
+            name = '{kind}{slot}'.format(kind='r' if op == OP_PUSH_REAL else 'i', slot=arg)
+            loaded.add(name)
+            stack.append(name)
+        elif op == OP_PUSHI:
+            value = consts[arg]
+            stack.append('({value!r})'.format(value=value) if value == value and abs(value) != float('inf')
+                         else 'consts[{arg}]'.format(arg=arg))
+        elif op == OP_MOV_INT:
+            name = 'i{slot}'.format(slot=arg)
+            stored.add(name)
+            lines.append('    ' * indent + 'value = ' + stack.pop())
+            lines.append('    ' * indent + 'if not -0x8000000000000000 <= value <= 0x7fffffffffffffff:')
+            lines.append('    ' * (indent + 1) + "raise Exception('Variable \"{name}\" is out of the INTEGER range!')"
+                         .format(name=int_names[arg]))
+            lines.append('    ' * indent + name + ' = value')
+        elif op == OP_MOV_REAL:
+            name = 'r{slot}'.format(slot=arg)
+            stored.add(name)
+            lines.append('    ' * indent + name + ' = ' + stack.pop())
+        elif op in (OP_ADD, OP_SUB, OP_MUL, OP_MOD):
+            right = stack.pop()
+            stack[-1] = '({left} {op} {right})'.format(left=stack[-1], right=right, op={
+                OP_ADD: '+', OP_SUB: '-', OP_MUL: '*', OP_MOD: '%'}[op])
+        elif op == OP_DIV:
+            right = stack.pop()
+            stack[-1] = 'int({left} / {right})'.format(left=stack[-1], right=right)
+        elif op == OP_F_DIV:
+            right = stack.pop()
+            stack[-1] = '({left} / {right})'.format(left=stack[-1], right=right)
+        elif op == OP_NEG:
+            stack[-1] = '(-{value})'.format(value=stack[-1])
+        elif op == OP_COUNT:
+            lines.append('    ' * indent + 'counters[{arg}] += 1'.format(arg=arg))
+        elif op in JUMPS:
+            right = stack.pop()
+            left = stack.pop()
+            lines.append('    ' * indent + 'if not {left} {op} {right}:'.format(left=left, op=JUMP_OPERATORS[op],
+                                                                              right=right))
+            lines.append('    ' * (indent + 1) + 'break')
+            # the instructions of an iteration, from the top of the loop to the jump
+            lines.append('    ' * indent + 'steps -= {size}'.format(size=pc - arg + 1))
+            lines.append('    ' * indent + 'if steps <= 0:')
+            lines.append('    ' * (indent + 1) + 'steps = look(fuel)')
+            lines.append('    ' * indent + 'fuel -= 1')
+            lines.append('    ' * indent + 'if not fuel:')
+            lines.append('    ' * (indent + 1) + 'fuel = check()')
+            indent -= 1
+        else:
+            return None
+    if stack or indent != 1:
+        return None
+    source = ['def loop(ints, reals, counters, consts, fuel, steps, check, look):']
+    for name in sorted(loaded | stored):
+        source.append('    {name} = {memory}[{slot}]'.format(
+            name=name, memory='reals' if name[0] == 'r' else 'ints', slot=name[1:]))
+    source.append('    try:')
+    source.extend('    ' + line for line in lines)
+    source.append('        return fuel, steps')
+    source.append('    finally:')
+    source.extend('        {memory}[{slot}] = {name}'.format(
+        name=name, memory='reals' if name[0] == 'r' else 'ints', slot=name[1:]) for name in sorted(stored))
+    if not stored:
+        source.append('        pass')
+    return '\n'.join(source) + '\n'
+
+
+# Runs StackCode: a loop that fetches the next opcode and dispatches on it, with a stack for the operands.
+# A loop that jumps back tier times is translated into a python function that runs the rest of its iterations, tier
+# None runs everything on the machine
+class StackMachine(object):
+
+    def __init__(self, code, tier=TIER_THRESHOLD, budget=None):
+        self.code = code
+        self.tier = tier
+        self.budget = budget if budget is not None else Budget()
+        # the iterations and the instructions left before the next check of the budget, None until the first run
+        self.fuel = None
+        self.steps = BUDGET_STEPS
+        self.symbol_table = dict((symbol.name, symbol.var_type) for symbol in code.declarations)
+        self.memory = Memory(code.declarations)
+        # code loaded from a file is a memoryview, indexing a list is faster in the loop below
+        self.ops, self.args = code.ops, code.args
+        if not isinstance(self.ops, list):
+            self.ops, self.args = self.ops.tolist(), self.args.tolist()
+        # one counter for every COUNT in the code, there are none unless the code was generated for profiling
+        self.counters = [0] * self.ops.count(OP_COUNT)
+        # where run() goes on from when it stopped at the end of a slice
+        self.pc = 0
+        self.stack = []
+        # how many times the jump before each pc went back
+        self.hot = [0] * (len(self.ops) + 1) if tier else None
+
+    # the python function of the loop that ends with the jump at pc, translated once for the code
+    def tier_up(self, top, pc):
+        compiled = self.code.compiled
+        if pc not in compiled:
+            compiled[pc] = None
+            source = translate_loop(self.code, top, pc)
+            if source is not None:
+                namespace = {}
+                try:
+                    exec(compile(source, '<loop {top}-{pc}>'.format(top=top, pc=pc), 'exec'), namespace)
+                # e.g. an expression nested too deep for the python parser
+                except (SyntaxError, RecursionError, MemoryError):
+                    pass
+                else:
+                    compiled[pc] = namespace['loop']
+        return compiled[pc]
+
+    # the values of the variables by name
+    @property
+    def memory_table(self):
+        return self.memory.table()
+
+    # raise the error for reading a variable that has no value yet
+    def not_assigned(self, real, slot):
+        name = self.code.slot_names()[real][slot]
+        raise Exception('"{var}" has not be declared or don"t have value assigned!'.format(var=name))
+
+    # Run the program to the end and return True. With a slice, stop after that many jumps back to the top of a loop and
+    # return False, the next call goes on from there. Only loops jump back, so a slice runs at most slice + 1 times the
+    # length of the code. Loops are not translated when running in slices, a translated loop runs to its end
+    def run(self, slice=None):
+        ops, args, consts, counters = self.ops, self.args, self.code.consts, self.counters
+        tier = self.tier if slice is None else None
+        hot = self.hot
+        memory = self.memory
+        ints, reals, int_set, real_set = memory.ints, memory.reals, memory.int_set, memory.real_set
+        stack = self.stack
+        push, pop = stack.append, stack.pop
+        budget = self.budget
+        if self.fuel is None:
+            self.fuel = budget.start()
+        fuel, steps = self.fuel, self.steps
+        pc = self.pc
+        end = len(ops)
+        while pc < end:
+            op = ops[pc]
+            arg = args[pc]
+            pc += 1
+            if op == OP_PUSH_INT:
+                if not int_set[arg]:
+                    self.not_assigned(False, arg)
+                push(ints[arg])
+            elif op == OP_PUSH_REAL:
+                if not real_set[arg]:
+                    self.not_assigned(True, arg)
+                push(reals[arg])
+            elif op == OP_PUSHI:
+                push(consts[arg])
+            elif op == OP_MOV_INT:
+                value = pop()
+                try:
+                    ints[arg] = value
+                except OverflowError:
+                    name = self.code.slot_names()[False][arg]
+                    raise Exception('Variable "{name}" is out of the INTEGER range!'.format(name=name))
+                int_set[arg] = 1
+            elif op == OP_MOV_REAL:
+                reals[arg] = pop()
+                real_set[arg] = 1
+            elif op == OP_ADD:
+                right = pop()
+                stack[-1] += right
+            elif op == OP_SUB:
+                right = pop()
+                stack[-1] -= right
+            elif op == OP_MUL:
+                right = pop()
+                stack[-1] *= right
+            elif op == OP_DIV:
+                right = pop()
+                stack[-1] = int(stack[-1] / right)
+            elif op == OP_F_DIV:
+                right = pop()
+                stack[-1] /= right
+            elif op == OP_MOD:
+                right = pop()
+                stack[-1] %= right
+            elif op == OP_NEG:
+                stack[-1] = -stack[-1]
+            else:
+                if op == OP_COUNT:
+                    counters[arg] += 1
+                    continue
+                right = pop()
+                left = pop()
+                if op == OP_JGE:
+                    jump = left >= right
+                elif op == OP_JG:
+                    jump = left > right
+                elif op == OP_JLE:
+                    jump = left <= right
+                elif op == OP_JL:
+                    jump = left < right
+                elif op == OP_JE:
+                    jump = left == right
+                else:
+                    jump = left != right
+                if jump:
+                    # only loops jump back, every instruction of the iteration is counted at its jump
+                    steps -= pc - arg
+                    if steps <= 0:
+                        steps = budget.look(fuel)
+                    fuel -= 1
+                    if not fuel:
+                        fuel = budget.check()
+                    if tier:
+                        hot[pc] += 1
+                        if hot[pc] >= tier:
+                            loop = self.tier_up(arg, pc - 1)
+                            if loop is not None:
+                                fuel, steps = loop(ints, reals, counters, consts, fuel, steps, budget.check,
+                                                   budget.look)
+                                continue
+                            # never try this loop again
+                            hot[pc] = -len(ops) * tier
+                    pc = arg
+                    if slice is not None:
+                        slice -= 1
+                        if not slice:
+                            self.pc, self.fuel, self.steps = pc, fuel, steps
+                            return False
+        self.pc, self.fuel, self.steps = pc, fuel, steps
+        return True
+
+
+# the names of the instructions of three-address code
+REGISTER_NAMES = dict(OP_NAMES)
+REGISTER_NAMES.update({OP_UNSET: 'UNSET', OP_SHL: 'SHL'})
+
+
+# The program lowered to three-address code. Every operand is a register: the INTEGER variables by slot, then the REAL
+# variables by slot, then one register per constant that holds it from the start, then the temporaries. An instruction
+# is a tuple (op, rd, rt, rs): ADD rd rt rs puts rt + rs in rd, NEG and MOV only use rt, a jump compares rt with rs
+# and goes back to the instruction rd, UNSET fails because the variable rt has no value yet
+class RegisterCode(object):
+    def __init__(self, declarations, instructions, consts, temps):
+        self.declarations = declarations
+        self.instructions = instructions
+        self.consts = consts
+        self.temps = temps
+        self.ints = sum(1 for symbol in declarations if not symbol.real)
+
+    # the register of each variable
+    def register(self, symbol):
+        return self.ints + symbol.slot if symbol.real else symbol.slot
+
+    # the name of every register, what the listing shows for it
+    def register_names(self):
+        names = [None] * (len(self.declarations) + len(self.consts) + self.temps)
+        for symbol in self.declarations:
+            names[self.register(symbol)] = symbol.name
+        base = len(self.declarations)
+        for index, value in enumerate(self.consts):
+            names[base + index] = value
+        base += len(self.consts)
+        for temp in range(self.temps):
+            names[base + temp] = 't{n}'.format(n=temp)
+        return names
+
+    # the text form, like StackCode.listing
+    def listing(self):
+        lines = ['{VAR}: .word {type}'.format(VAR=symbol.name, type=symbol.var_type) for symbol in self.declarations]
+        names = self.register_names()
+        labels = {}
+        for op, rd, rt, rs in self.instructions:
+            if op in JUMPS and rd not in labels:
+                labels[rd] = 'L{n}'.format(n=len(labels))
+        for pc, (op, rd, rt, rs) in enumerate(self.instructions):
+            if pc in labels:
+                lines.append('{label}:'.format(label=labels[pc]))
+            if op in JUMPS:
+                lines.append(str(Three_Instruction(REGISTER_NAMES[op], labels[rd], names[rt], names[rs])))
+            elif op == OP_UNSET:
+                lines.append(str(One_Instruction(REGISTER_NAMES[op], names[rt])))
+            elif op in (OP_MOV_INT, OP_NEG):
+                lines.append(str(Two_Instruction(REGISTER_NAMES[op], names[rd], names[rt])))
+            else:
+                lines.append(str(Three_Instruction(REGISTER_NAMES[op], names[rd], names[rt], names[rs])))
+        return lines
+
+
+# Lowers the tree to RegisterCode. The temporaries of an expression are numbered by how deep they would be on the
+# stack, so an expression needs as many of them as the stack machine needs stack, and the last operator of an
+# assignment writes straight into the variable instead of a temporary and a MOV.
+# At -O3 the loops are optimized as well: what a loop computes the same on every iteration is computed once in front of
+# it, an INTEGER counter times a constant is kept in a register that goes up with the counter instead of being
+# multiplied every time, and a multiplication by a power of two is an addition or a shift
+class RegisterGenerator(object):
+
+    def __init__(self, program, optimize=0):
+        self.program = program
+        self.optimize = optimize
+        self.instructions = []
+        self.consts = []
+        self.const_index = {}
+        self.temps = 0
+        # registers that keep the values computed in front of loops, numbered after the temporaries
+        self.kept = 0
+        # the variables that have an assignment earlier in the source. Every statement runs for the first time after
+        # all the ones before it and before all the ones after it, as there are only loops that run at least once, so a
+        # read of any other variable is known to fail when it is reached
+        self.assigned = set()
+        self.ints = sum(1 for symbol in program.declarations if not symbol.real)
+        # expression node -> the kept register that holds its value
+        self.bound = {}
+        # the nodes of bound that are a counter times a constant -> the counter
+        self.products = {}
+        # assignment to a counter -> [(register, increment)], the registers of its products and what to add to them
+        self.steps = {}
+
+    def emit(self, op, rd=None, rt=None, rs=None):
+        self.instructions.append([op, rd, rt, rs])
+
+    # constants, temporaries and kept registers are ('const', index), ('temp', depth) and ('kept', index) until the
+    # number of constants is known, generate() turns them into registers
+    def constant(self, value):
+        key = (type(value), value)
+        index = self.const_index.get(key)
+        if index is None:
+            index = self.const_index[key] = len(self.consts)
+            self.consts.append(value)
+        return ('const', index)
+
+    def temp(self, depth):
+        self.temps = max(self.temps, depth + 1)
+        return ('temp', depth)
+
+    def keep(self):
+        self.kept += 1
+        return ('kept', self.kept - 1)
+
+    def register(self, symbol):
+        return self.ints + symbol.slot if symbol.real else symbol.slot
+
+    # the instructions of an expression, returns the register that holds its value. depth is the number of values the
+    # caller still needs, their temporaries are left alone
+    def expression(self, node, depth=0):
+        operands = []
+        for item in postfix(node, self.bound):
+            if item in self.bound:
+                operands.append(self.bound[item])
+            elif isinstance(item, Shared):
+                operands.append(self.bound[item.node])
+            elif isinstance(item, Const):
+                operands.append(self.constant(item.value))
+            elif isinstance(item, Var):
+                register = self.register(item.symbol)
+                if item.symbol not in self.assigned:
+                    self.emit(OP_UNSET, rt=register)
+                operands.append(register)
+            elif isinstance(item, UnaryOp):
+                if item.op == TK_MINUS:
+                    temp = self.result(item, depth + len(operands) - 1)
+                    self.emit(OP_NEG, temp, operands[-1])
+                    operands[-1] = temp
+            else:
+                right = operands.pop()
+                temp = self.result(item, depth + len(operands) - 1)
+                op, left = BINARY_OPCODES[item.op], operands[-1]
+                if self.optimize >= 3 and item.op == TK_MUL:
+                    op, left, right = self.multiply(item, left, right)
+                self.emit(op, temp, left, right)
+                operands[-1] = temp
+        return operands[0]
+
+    # where an operator puts its value: the temporary at depth, or a kept register bound to it when Shared nodes use it
+    def result(self, node, depth):
+        if node.shared:
+            self.bound[node] = self.keep()
+            return self.bound[node]
+        return self.temp(depth)
+
+    # -O3, a multiplication by a constant power of two: x * 2 is x + x, and an INTEGER x * 2^k is x << k. Returns the
+    # instruction that computes node from the registers left and right
+    def multiply(self, node, left, right):
+        for const, other, operand in ((node.right, node.left, left), (node.left, node.right, right)):
+            if not isinstance(const, Const):
+                continue
+            value = const.value
+            if not node.real and type(value) is int and value > 1 and not value & (value - 1):
+                shift = value.bit_length() - 1
+                if shift == 1:
+                    return OP_ADD, operand, operand
+                return OP_SHL, operand, self.constant(shift)
+            if value == 2 and node.real and self.real(other):
+                return OP_ADD, operand, operand
+        return OP_MUL, left, right
+
+    @staticmethod
+    def real(node):
+        if isinstance(node, Const):
+            return type(node.value) is float
+        if isinstance(node, Var):
+            return node.symbol.real
+        return node.real
+
+    # the increment of a counter that an assignment adds, None when it is not counter := counter +- constant
+    @staticmethod
+    def increment(node):
+        expr = node.expr
+        if isinstance(expr, BinOp) and expr.op in (TK_ADD, TK_MINUS):
+            for var, const in ((expr.left, expr.right), (expr.right, expr.left)):
+                if (isinstance(var, Var) and var.symbol is node.symbol and isinstance(const, Const)
+                        and type(const.value) is int and (expr.op == TK_ADD or var is expr.left)):
+                    return const.value if expr.op == TK_ADD else -const.value
+        return None
+
+    # whether an operator on invariant operands can be computed in front of the loop: it cannot fail, and a REAL result
+    # does not convert an INTEGER value that could be too large for a float
+    def hoistable(self, node):
+        if isinstance(node, UnaryOp):
+            return node.op == TK_MINUS
+        if node.op not in (TK_ADD, TK_MINUS, TK_MUL):
+            return False
+        if not node.real:
+            return True
+        for operand in (node.left, node.right):
+            if self.real(operand):
+                continue
+            if isinstance(operand, Const):
+                if not -0x8000000000000000 <= operand.value <= 0x7fffffffffffffff:
+                    return False
+            elif not isinstance(operand, Var) or operand in self.bound:
+                return False
+        return True
+
+    # -O3, the instructions in front of a loop: its counter products and its largest invariant expressions are put in
+    # kept registers and bound to them
+    def hoist(self, loop):
+        body = list(walk_statements(loop.body))
+        updates = {}
+        for node in body:
+            if isinstance(node, Assign):
+                updates.setdefault(node.symbol, []).append(node)
+        # the variables that keep their value in the loop are the ones it does not assign, only once they have one
+        available = self.assigned.difference(updates)
+        # a counter has a value when the loop starts and is only changed by adding constants to it
+        counters = set(symbol for symbol, nodes in updates.items() if symbol in self.assigned and not symbol.real
+                       and all(self.increment(node) is not None for node in nodes))
+        expressions = [loop.condition.left, loop.condition.right]
+        for node in body:
+            if isinstance(node, Assign):
+                expressions.append(node.expr)
+            elif isinstance(node, Repeat):
+                expressions += [node.condition.left, node.condition.right]
+        products = {}
+        hoisted = []
+        for expression in expressions:
+            invariant = {}
+            inner = set()
+            items = postfix(expression, self.bound)
+            for item in items:
+                if item in self.bound:
+                    symbol = self.products.get(item)
+                    invariant[item] = symbol is None or symbol not in updates
+                elif isinstance(item, Shared):
+                    # its node is in the loop too and not computed yet
+                    invariant[item] = False
+                elif isinstance(item, Const):
+                    invariant[item] = True
+                elif isinstance(item, Var):
+                    invariant[item] = item.symbol in available
+                elif isinstance(item, UnaryOp):
+                    invariant[item] = invariant[item.expr] and self.hoistable(item)
+                    if invariant[item]:
+                        inner.add(item.expr)
+                else:
+                    invariant[item] = invariant[item.left] and invariant[item.right] and self.hoistable(item)
+                    if invariant[item]:
+                        inner.add(item.left)
+                        inner.add(item.right)
+                    elif item.op == TK_MUL and not item.real:
+                        for var, const in ((item.left, item.right), (item.right, item.left)):
+                            if isinstance(var, Var) and var.symbol in counters and isinstance(const, Const):
+                                products.setdefault((var.symbol, const.value), []).append(item)
+                                break
+            # the invariant operators that are not inside a larger invariant one, expressions of constants only are
+            # left to the folding
+            for item in items:
+                if (invariant[item] and item not in inner and item not in self.bound
+                        and isinstance(item, (BinOp, UnaryOp))
+                        and any(isinstance(leaf, Var) or leaf in self.bound for leaf in postfix(item, self.bound))):
+                    hoisted.append(item)
+        for (symbol, value), nodes in products.items():
+            register = self.keep()
+            self.emit(OP_MUL, register, self.register(symbol), self.constant(value))
+            for node in nodes:
+                self.bound[node] = register
+                self.products[node] = symbol
+            for node in updates[symbol]:
+                self.steps.setdefault(node, []).append((register, self.increment(node) * value))
+        for node in hoisted:
+            self.expression(node)
+            # node is an operator, so the last instruction computes it. A shared one is bound to a register already
+            if node not in self.bound:
+                self.instructions[-1][1] = self.bound[node] = self.keep()
+
+    def statements(self, statements):
+        for node in statements:
+            if isinstance(node, Assign):
+                value = self.expression(node.expr)
+                target = self.register(node.symbol)
+                # the operator that computed the value writes it to the variable directly
+                if isinstance(value, tuple) and value[0] == 'temp' and self.instructions[-1][1] == value:
+                    self.instructions[-1][1] = target
+                else:
+                    self.emit(OP_MOV_INT, target, value)
+                self.assigned.add(node.symbol)
+                for register, increment in self.steps.get(node, ()):
+                    self.emit(OP_ADD, register, register, self.constant(increment))
+            elif isinstance(node, Block):
+                self.statements(node.statements)
+            else:
+                if self.optimize >= 3:
+                    self.hoist(node)
+                top = len(self.instructions)
+                self.statements(node.body)
+                left = self.expression(node.condition.left)
+                right = self.expression(node.condition.right, 1)
+                self.emit(LOOP_JUMPS[node.condition.op], top, left, right)
+
+    # main function, returns the RegisterCode of the program
+    def generate(self):
+        check_types(self.program.block.statements)
+        self.statements(self.program.block.statements)
+        bases = {'const': len(self.program.declarations)}
+        bases['temp'] = bases['const'] + len(self.consts)
+        bases['kept'] = bases['temp'] + self.temps
+        instructions = []
+        for instruction in self.instructions:
+            instructions.append(tuple(bases[operand[0]] + operand[1] if isinstance(operand, tuple) else operand
+                                      for operand in instruction))
+        return RegisterCode(list(self.program.declarations), instructions, self.consts, self.temps + self.kept)
+
+
+# Runs RegisterCode: every instruction reads its operands from the list of registers and writes its result back, there
+# is no stack. Only the registers of INTEGER variables are checked for the range of the memory of the stack machine
+class RegisterMachine(object):
+
+    def __init__(self, code, budget=None):
+        self.code = code
+        self.budget = budget if budget is not None else Budget()
+        self.symbol_table = dict((symbol.name, symbol.var_type) for symbol in code.declarations)
+        # None until a variable has a value
+        self.registers = [None] * len(code.declarations) + list(code.consts) + [None] * code.temps
+
+    # the values of the variables by name
+    @property
+    def memory_table(self):
+        table = {}
+        for symbol in self.code.declarations:
+            value = self.registers[self.code.register(symbol)]
+            if value is not None:
+                table[symbol.name] = value
+        return table
+
+    def run(self):
+        registers = self.registers
+        instructions = self.code.instructions
+        ints = self.code.ints
+        budget = self.budget
+        fuel = budget.start()
+        steps = BUDGET_STEPS
+        pc = 0
+        end = len(instructions)
+        while pc < end:
+            op, rd, rt, rs = instructions[pc]
+            pc += 1
+            if op == OP_ADD:
+                value = registers[rt] + registers[rs]
+            elif op == OP_SUB:
+                value = registers[rt] - registers[rs]
+            elif op == OP_MUL:
+                value = registers[rt] * registers[rs]
+            elif op == OP_MOV_INT:
+                value = registers[rt]
+            elif op == OP_DIV:
+                value = int(registers[rt] / registers[rs])
+            elif op == OP_F_DIV:
+                value = registers[rt] / registers[rs]
+            elif op == OP_MOD:
+                value = registers[rt] % registers[rs]
+            elif op == OP_NEG:
+                value = -registers[rt]
+            elif op == OP_SHL:
+                value = registers[rt] << registers[rs]
+            elif op == OP_UNSET:
+                name = self.code.register_names()[rt]
+                raise Exception('"{var}" has not be declared or don"t have value assigned!'.format(var=name))
+            else:
+                left, right = registers[rt], registers[rs]
+                if op == OP_JGE:
+                    jump = left >= right
+                elif op == OP_JG:
+                    jump = left > right
+                elif op == OP_JLE:
+                    jump = left <= right
+                elif op == OP_JL:
+                    jump = left < right
+                elif op == OP_JE:
+                    jump = left == right
+                else:
+                    jump = left != right
+                if jump:
+                    # the instructions of the iteration, from the top of the loop to this jump
+                    steps -= pc - rd
+                    if steps <= 0:
+                        steps = budget.look(fuel)
+                    pc = rd
+                    fuel -= 1
+                    if not fuel:
+                        fuel = budget.check()
+                continue
+            if rd < ints and not -0x8000000000000000 <= value <= 0x7fffffffffffffff:
+                name = self.code.register_names()[rd]
+                raise Exception('Variable "{name}" is out of the INTEGER range!'.format(name=name))
+            registers[rd] = value
+
+
+# What --profile records: the wall time of every phase, the number of tokens, how many times every assignment ran and
+# every loop went around and how many instructions of each kind were emitted.
+# Nothing is recorded unless a Profile is passed in, the normal classes have no checks for it
+class Profile(object):
+
+    def __init__(self):
+        self.phases = {}
+        self.tokens = 0
+        # statement or loop node -> how many times it ran, a loop counts its iterations
+        self.counts = {}
+        # the node of each counter used by the stack machine
+        self.counters = []
+        self.instructions = {}
+        # the source file, and whether the positions in it count bytes (file scanner) or characters
+        self.source = None
+        self.byte_offsets = False
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - start
+
+    def count(self, node):
+        self.counts[node] = self.counts.get(node, 0) + 1
+
+    # a new counter of the stack machine for node
+    def counter(self, node):
+        self.counters.append(node)
+        return len(self.counters) - 1
+
+    # add the counters of a finished stack machine
+    def add_counters(self, counters):
+        for node, value in zip(self.counters, counters):
+            self.counts[node] = self.counts.get(node, 0) + value
+
+    # count the instructions of the trace by their name
+    def count_trace(self, trace):
+        for op in trace.ops:
+            kind = TRACE_NAMES[op]
+            self.instructions[kind] = self.instructions.get(kind, 0) + 1
+
+    # count the instructions of stack code by their name, the COUNTs of the profile itself are left out
+    def count_code(self, code):
+        for op in code.ops:
+            if op != OP_COUNT:
+                self.instructions[OP_NAMES[op]] = self.instructions.get(OP_NAMES[op], 0) + 1
+
+    # line numbers of sorted offsets in the source, None when the source is not known
+    def lines(self, positions):
+        if self.source is None:
+            return [None] * len(positions)
+        with open(self.source, 'rb' if self.byte_offsets else 'r') as source:
+            text = source.read()
+        newline = b'\n' if self.byte_offsets else '\n'
+        line, last, result = 1, 0, []
+        for pos in positions:
+            line += text.count(newline, last, pos)
+            last = pos
+            result.append(line)
+        return result
+
+    def to_dict(self):
+        counts = sorted(self.counts.items(), key=lambda item: item[0].pos)
+        statements = []
+        for (node, count), line in zip(counts, self.lines([node.pos for node, _ in counts])):
+            statements.append({'kind': 'assign' if isinstance(node, Assign) else 'repeat',
+                               'target': node.name if isinstance(node, Assign) else None,
+                               'pos': node.pos, 'line': line, 'count': count})
+        return {'phases': self.phases, 'tokens': self.tokens, 'statements': statements,
+                'instructions': self.instructions}
+
+    def report(self):
+        data = self.to_dict()
+        lines = ['Profile:', '  phases (seconds):']
+        for name, seconds in data['phases'].items():
+            lines.append('    {name:<10} {seconds:.6f}'.format(name=name, seconds=seconds))
+        lines.append('  tokens: {tokens}'.format(tokens=data['tokens']))
+        lines.append('  statements (times run, loops count iterations):')
+        for statement in data['statements']:
+            where = 'line {line}'.format(line=statement['line']) if statement['line'] else 'pos {pos}'.format(
+                pos=statement['pos'])
+            what = '{target} :='.format(target=statement['target']) if statement['target'] else 'REPEAT'
+            lines.append('    {where:<10} {what:<12} {count}'.format(where=where, what=what, count=statement['count']))
+        lines.append('  instructions emitted:')
+        for kind, count in sorted(data['instructions'].items(), key=lambda item: -item[1]):
+            lines.append('    {kind:<6} {count}'.format(kind=kind, count=count))
+        return '\n'.join(lines)
+
+
+# time a phase when there is a profile, do nothing otherwise
+def profile_phase(profile, name):
+    if profile is None:
+        return no_phase()
+    return profile.phase(name)
+
+
+# the phase of profile_phase without a profile, contextlib.nullcontext needs python 3.7
+@contextlib.contextmanager
+def no_phase():
+    yield
+
+
+# Passes the tokens of a scanner through and counts them, only used when profiling
+class CountingScanner(object):
+
+    def __init__(self, scanner, profile):
+        self.scanner = scanner
+        self.profile = profile
+
+    @property
+    def start(self):
+        return self.scanner.start
+
+    def get_next_token(self):
+        token = self.scanner.get_next_token()
+        if token.tk_type != TK_EOF:
+            self.profile.tokens += 1
+        return token
+
+
+# The interpreter with counters for the statements and the loop iterations
+class ProfilingInterpreter(Interpreter):
+
+    def __init__(self, program, profile):
+        Interpreter.__init__(self, program)
+        self.profile = profile
+        self.loops = dict((node.pos, node) for node in walk_statements(program.block.statements)
+                          if isinstance(node, Repeat))
+
+    def assignment(self, node):
+        self.profile.count(node)
+        Interpreter.assignment(self, node)
+
+    def comparison(self, node, pos):
+        self.profile.count(self.loops[pos])
+        return Interpreter.comparison(self, node, pos)
+
+
+# Binary file format of StackCode, all numbers little endian:
+#   header      magic, format version, number of symbols, constants and instructions, size of the names
+#   symbols     one byte per symbol, 1 for REAL, then the names separated by newlines, in declaration order
+#   constants   one byte per constant, 0 for an int64, 1 for a double and 2 for an INTEGER out of the int64 range, then
+#               8 bytes per constant: the int64, the double, or the length of the decimal text of the large INTEGER
+#   large       the decimal texts of the large INTEGER constants, one after the other
+#   code        one byte per opcode, then an int32 argument per instruction (0 when the opcode takes none)
+# Every section starts at a multiple of 8, so the code can be used straight from a memory map through memoryview casts
+CODE_MAGIC = b'PSTK'
+# 2: the types are checked when compiling, the machine no longer checks the values it stores
+# 3: INTEGER constants out of the int64 range
+CODE_FORMAT = 3
+CODE_HEADER = struct.Struct('<4sHxxIIII')
+# changes whenever the code generated for the same source changes, part of the cache key
+COMPILER_VERSION = '{format}.1'.format(format=CODE_FORMAT)
+
+
+def align(size):
+    return (size + 7) & ~7
+
+
+# the kind byte of a constant in the binary format
+def const_kind(value):
+    if type(value) is float:
+        return 1
+    return 0 if -0x8000000000000000 <= value <= 0x7fffffffffffffff else 2
+
+
+# StackCode -> bytes
+def dump_code(code):
+    names = '\n'.join(symbol.name for symbol in code.declarations).encode('utf-8')
+    kinds = [const_kind(value) for value in code.consts]
+    values, large = bytearray(), bytearray()
+    for value, kind in zip(code.consts, kinds):
+        if kind == 1:
+            values += struct.pack('<d', value)
+        elif kind == 0:
+            values += struct.pack('<q', value)
+        else:
+            text = str(value).encode('ascii')
+            values += struct.pack('<q', len(text))
+            large += text
+    parts = [CODE_HEADER.pack(CODE_MAGIC, CODE_FORMAT, len(code.declarations), len(code.consts), len(code.ops),
+                              len(names)),
+             bytes(symbol.real for symbol in code.declarations) + names,
+             bytes(kinds),
+             values,
+             large,
+             bytes(code.ops),
+             array('i', [0 if arg is None else arg for arg in code.args])]
+    if sys.byteorder == 'big':
+        parts[-1].byteswap()
+    data = bytearray()
+    for part in parts:
+        data += part
+        data += bytes(align(len(data)) - len(data))
+    return bytes(data)
+
+
+# bytes, a bytearray, or a memory map -> StackCode. The opcodes and arguments are memoryviews into the buffer itself.
+# Raises ValueError when the buffer is not a whole compiled program, e.g. a file that was cut short
+def load_code(buffer):
+    view = memoryview(buffer)
+    if len(view) < CODE_HEADER.size:
+        raise ValueError('Compiled program is cut short!')
+    magic, version, symbols, consts, size, names = CODE_HEADER.unpack_from(view)
+    if magic != CODE_MAGIC or version != CODE_FORMAT:
+        raise ValueError('Not a compiled program of format {format}!'.format(format=CODE_FORMAT))
+    pos = CODE_HEADER.size
+    # the sections before the large constants have sizes given by the header
+    if len(view) < align(align(align(pos + symbols + names) + consts) + 8 * consts):
+        raise ValueError('Compiled program is cut short!')
+    kinds = bytes(view[pos:pos + symbols])
+    declarations = []
+    slots = {'INTEGER': 0, 'REAL': 0}
+    for real, name in zip(kinds, bytes(view[pos + symbols:pos + symbols + names]).decode('utf-8').split('\n')):
+        var_type = 'REAL' if real else 'INTEGER'
+        declarations.append(Symbol(name, var_type, slots[var_type]))
+        slots[var_type] += 1
+    if len(declarations) != symbols:
+        raise ValueError('Compiled program has {count} names for {symbols} symbols!'.format(
+            count=len(declarations), symbols=symbols))
+    pos = align(pos + symbols + names)
+    kinds = bytes(view[pos:pos + consts])
+    pos = align(pos + consts)
+    values = []
+    large = align(pos + 8 * consts)
+    for index, kind in enumerate(kinds):
+        if kind > 2:
+            raise ValueError('Compiled program has a constant of unknown kind {kind}!'.format(kind=kind))
+        value = struct.unpack_from('<d' if kind == 1 else '<q', view, pos + 8 * index)[0]
+        if kind == 2:
+            if not 0 < value <= len(view) - large:
+                raise ValueError('Compiled program is cut short!')
+            value, large = int(bytes(view[large:large + value])), large + value
+        values.append(value)
+    pos = align(large)
+    if len(view) != align(align(pos + size) + 4 * size):
+        raise ValueError('Compiled program is cut short or has extra bytes!')
+    ops = view[pos:pos + size]
+    pos = align(pos + size)
+    args = view[pos:pos + 4 * size].cast('i')
+    if sys.byteorder == 'big':
+        args = array('i', args)
+        args.byteswap()
+    return StackCode(declarations, ops, args, values)
+
+
+def save_code(code, path):
+    with open(path, 'wb') as out:
+        out.write(dump_code(code))
+
+
+# map the file and load it, the map stays open as long as the code uses it
+def read_code(path):
+    with open(path, 'rb') as source:
+        return load_code(mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+# A folder of compiled programs. The file name is a hash of the source, the compiler version and the optimize level,
+# so a program that did not change is loaded from the folder without scanning or parsing it again
+class CompileCache(object):
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    @staticmethod
+    def new_digest(optimize):
+        digest = hashlib.sha256()
+        digest.update('{version}\0{level}\0'.format(version=COMPILER_VERSION, level=optimize).encode('ascii'))
+        return digest
+
+    # the key of a source given as bytes
+    def key(self, source, optimize):
+        digest = self.new_digest(optimize)
+        digest.update(source)
+        return digest.hexdigest()
+
+    # the key of a source file, read a chunk at a time
+    def file_key(self, path, optimize):
+        digest = self.new_digest(optimize)
+        with open(path, 'rb') as source:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.folder, key + '.pstk')
+
+    # the StackCode stored under key, or None when it is not in the cache
+    def get(self, key):
+        try:
+            return read_code(self.path(key))
+        except (OSError, ValueError, struct.error):
+            return None
+
+    # write to a temporary file first, so another process never reads half a file, and remove it when that fails
+    def put(self, key, code):
+        temp = '{path}.{pid}.tmp'.format(path=self.path(key), pid=os.getpid())
+        try:
+            save_code(code, temp)
+            os.replace(temp, self.path(key))
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+
+
+# The parser of the incremental compiler: every statement also gets the span of source it came from, start is its
+# first token and end the token after it. base is added to the positions when only a part of the source is parsed,
+# the variables then come from the parser of the whole program
+class SpanParser(Parser):
+
+    def __init__(self, scanner, base=0, program_parser=None):
+        Parser.__init__(self, scanner)
+        self.base = base
+        if program_parser is not None:
+            self.symbol_table = program_parser.symbol_table
+            self.symbols = program_parser.symbols
+            self.slots = program_parser.slots
+
+    def token_pos(self):
+        return self.scanner.start + self.base
+
+    def statement(self):
+        start = self.token_pos()
+        node = Parser.statement(self)
+        if node is not None:
+            node.start, node.end = start, self.token_pos()
+        return node
+
+
+# The start or end positions of a list of statements as a sequence, so bisect can search them without the key
+# argument that needs python 3.10
+class Positions(object):
+    def __init__(self, statements, name):
+        self.statements = statements
+        self.name = name
+
+    def __len__(self):
+        return len(self.statements)
+
+    def __getitem__(self, index):
+        return getattr(self.statements[index], self.name)
+
+
+# Keeps the tree and the stack code of a source between edits, for an editor that compiles on every key. An edit only
+# re-lexes, re-parses and generates code for the innermost statements around it, their new code replaces the old one
+# in place and the statements after them only have their positions moved. An edit that is not inside a run of
+# statements, e.g. in the declarations, or whose statements do not parse on their own compiles everything again.
+# There is no peephole pass: what it removes depends on the statements before, so only the constants are folded.
+# The constants of the replaced code stay in the pool until it gets twice as big as after the last compact()
+class IncrementalCompiler(object):
+
+    def __init__(self, text, optimize=0):
+        self.optimize = optimize
+        self.text = text
+        self.program = None
+        # the part of the source parsed by the last edit, or None when everything was compiled
+        self.reparsed = None
+        self.compile()
+
+    @property
+    def code(self):
+        return StackCode(list(self.program.declarations), self.ops, self.args, self.generator.consts)
+
+    def compile(self):
+        self.program = self.reparsed = None
+        parser = SpanParser(Scanner(self.text))
+        program = parser.program()
+        if self.optimize:
+            fold_statements(program.block.statements)
+        check_types(program.block.statements)
+        self.generator = CodeGenerator(program)
+        self.ops, self.args = self.generate(program.block.statements, 0)
+        self.parser, self.program = parser, program
+        self.pool_limit = 2 * len(self.generator.consts) + 16
+
+    # Number the constants in the order the code first uses them, like a full compile does, and drop the ones no code
+    # uses any more, e.g. the old value of a literal that was typed over
+    def compact(self):
+        generator = self.generator
+        consts, index = [], {}
+        for pc, op in enumerate(self.ops):
+            if op == OP_PUSHI:
+                new = index.get(self.args[pc])
+                if new is None:
+                    new = index[self.args[pc]] = len(consts)
+                    consts.append(generator.consts[self.args[pc]])
+                self.args[pc] = new
+        generator.consts = consts
+        generator.const_index = dict(((type(value), value), new) for new, value in enumerate(consts))
+        self.pool_limit = 2 * len(consts) + 16
+
+    # the code of some statements as if it started at base, every statement gets the range of its code
+    def generate(self, statements, base):
+        self.generator.ops, self.generator.args = [], []
+        self.emit(statements, base)
+        return self.generator.ops, self.generator.args
+
+    # like CodeGenerator.statements, but the loops jump straight to where their code starts instead of to a label
+    def emit(self, statements, base):
+        generator = self.generator
+        for node in statements:
+            node.code_start = base + len(generator.ops)
+            if isinstance(node, Assign):
+                generator.expression(node.expr)
+                generator.emit(OP_MOV_REAL if node.symbol.real else OP_MOV_INT, node.symbol.slot)
+            elif isinstance(node, Block):
+                self.emit(node.statements, base)
+            else:
+                self.emit(node.body, base)
+                generator.expression(node.condition.left)
+                generator.expression(node.condition.right)
+                generator.emit(LOOP_JUMPS[node.condition.op], node.code_start)
+            node.code_end = base + len(generator.ops)
+
+    # The innermost run of statements, first to last in one list, that holds [start, end) with at least one more
+    # character of the run after it, so the edit can not join a token to the one after the run. Returns the path
+    # down to it as (statements, first, last) for every level, or None when no run holds it
+    def find(self, start, end):
+        path = []
+        statements = self.program.block.statements
+        while True:
+            first = bisect.bisect_right(Positions(statements, 'start'), start) - 1
+            last = bisect.bisect_right(Positions(statements, 'end'), end)
+            if first < 0 or last >= len(statements) or first > last:
+                return path or None
+            path.append((statements, first, last))
+            node = statements[first]
+            if first != last or isinstance(node, Assign):
+                return path
+            statements = node.statements if isinstance(node, Block) else node.body
+            # the edit may be in a part of the statement that is not one of its statements, e.g. UNTIL a > b
+            if not statements:
+                return path
+
+    # Replace length characters at offset with text and bring the tree and the code up to date
+    def edit(self, offset, length, text):
+        if offset < 0 or length < 0 or offset + length > len(self.text):
+            raise Exception('Edit at {offset} of length {length} is outside the source!'.format(
+                offset=offset, length=length))
+        self.text = self.text[:offset] + text + self.text[offset + length:]
+        delta = len(text) - length
+        path = None if self.program is None else self.find(offset, offset + length)
+        if path is None:
+            return self.compile()
+        statements, first, last = path[-1]
+        start, end = statements[first].start, statements[last].end + delta
+        code_start, code_end = statements[first].code_start, statements[last].code_end
+        try:
+            parser = SpanParser(Scanner(self.text[start:end]), start, self.parser)
+            new = parser.statement_list()
+            if parser.curr_token.tk_type != TK_EOF:
+                raise Exception('The statements do not end at the end of the edited part')
+            if self.optimize:
+                fold_statements(new)
+            check_types(new)
+            ops, args = self.generate(new, code_start)
+        except Exception:
+            return self.compile()
+        self.reparsed = (start, end)
+        # put the new code in, the loops after it jump to where their code moved
+        code_delta = len(ops) - (code_end - code_start)
+        self.ops[code_start:code_end] = ops
+        self.args[code_start:code_end] = args
+        if code_delta:
+            for pc in range(code_start + len(ops), len(self.ops)):
+                if self.ops[pc] in JUMPS and self.args[pc] >= code_end:
+                    self.args[pc] += code_delta
+        statements[first:last + 1] = new
+        if len(self.generator.consts) > self.pool_limit:
+            self.compact()
+        if not delta and not code_delta:
+            return
+        # the statements holding the new ones get longer, the ones after them move
+        for level, (statements, first, last) in enumerate(path):
+            if level < len(path) - 1:
+                statements[first].end += delta
+                statements[first].code_end += code_delta
+                after = first + 1
+            else:
+                after = first + len(new)
+            for node in walk_statements(itertools.islice(statements, after, None)):
+                node.start += delta
+                node.end += delta
+                node.code_start += code_delta
+                node.code_end += code_delta
+                if not isinstance(node, Block):
+                    node.pos += delta
+
+
+# Scan and parse a source file into the tree
+def parse_file(path, stream=False, profile=None):
+    text = None
+    if not stream:
+        # Take in the input_file
+        with profile_phase(profile, 'read'), open(path, 'r') as input_file:
+            text = input_file.read()
 #     text = """\
 # PROGRAM TestProgram;
 # VAR
@@ -560,18 +2798,307 @@ def main():
 # END.
 #  """
     # Initialize scanner and parser
-    scanner = Scanner(text)
+    with profile_phase(profile, 'scan'):
+        if text is None:
+            scanner = FileScanner(path)
+        else:
+            scanner = Scanner(text)
+    if profile is not None:
+        profile.source = path
+        profile.byte_offsets = text is None
+        scanner = CountingScanner(scanner, profile)
     parser = Parser(scanner)
-    # Call the parser main program
-    parser.program()
+    # Call the parser main program to get the tree, the file scanner lexes while the parser runs
+    with profile_phase(profile, 'parse'):
+        return parser.program()
+
+
+# Profile a whole run of a source file, returns the Profile and the interpreter or stack machine that ran it
+def profile_file(path, compile=False, optimize=0, stream=False):
+    profile = Profile()
+    program = parse_file(path, stream, profile)
+    if optimize:
+        with profile.phase('optimize'):
+            optimize_program(program, optimize)
+    if compile:
+        with profile.phase('codegen'):
+            code = CodeGenerator(program, optimize, profile).generate()
+        profile.count_code(code)
+        machine = StackMachine(code)
+        with profile.phase('execute'):
+            machine.run()
+        profile.add_counters(machine.counters)
+    else:
+        machine = ProfilingInterpreter(program, profile)
+        with profile.phase('execute'):
+            machine.run()
+        profile.count_trace(machine.code)
+    return profile, machine
+
+
+# Compile and run one source file and write what would be its simple_stack to output, for the batch driver. Errors are
+# returned in the result instead of raised, so one bad file does not stop the others. tier and backend are those of
+# main, the cache only keeps stack code
+def compile_file(path, output, compile=False, optimize=0, stream=False, cache=None, format='json', budget=None,
+                 tier=TIER_THRESHOLD, backend='stack'):
+    start = time.perf_counter()
+    result = {'input': path, 'output': output, 'error': None}
+    try:
+        code = program = None
+        if compile and cache and backend == 'stack':
+            cache = CompileCache(cache)
+            key = cache.file_key(path, optimize)
+            code = cache.get(key)
+        if code is None:
+            program = parse_file(path, stream)
+            optimize_program(program, optimize)
+            if compile and backend == 'register':
+                code = RegisterGenerator(program, optimize).generate()
+            elif compile:
+                code = CodeGenerator(program, optimize).generate()
+                if cache:
+                    cache.put(key, code)
+        budget = budget.renew() if budget is not None else None
+        if compile:
+            machine = RegisterMachine(code, budget) if backend == 'register' else StackMachine(code, tier, budget)
+            machine.run()
+            write_trace(output, code.listing(), format)
+        else:
+            with TraceWriter(output, format) as writer:
+                machine = Interpreter(program, writer, budget)
+                machine.run()
+        result['symbol_table'] = machine.symbol_table
+        result['memory_table'] = machine.memory_table
+    except BudgetExceeded as error:
+        result['error'] = str(error)
+        result['budget'] = error.stats
+    except Exception as error:
+        result['error'] = str(error)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+# the extension of the files written by the batch driver, they are skipped when a folder is compiled
+OUTPUT_SUFFIX = '.stack'
+
+
+# The source files to compile and where each one's output goes. A folder stands for every file in it, the output of
+# a file goes next to it unless there is an output folder
+def batch_files(inputs, output_dir=None):
+    paths = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if not name.startswith('.') and not name.endswith(OUTPUT_SUFFIX) and \
+                        os.path.isfile(os.path.join(path, name)):
+                    paths.append(os.path.join(path, name))
+        else:
+            paths.append(path)
+    files = []
+    outputs = set()
+    for path in paths:
+        if output_dir is None:
+            output = path + OUTPUT_SUFFIX
+        else:
+            output = os.path.join(output_dir, os.path.basename(path) + OUTPUT_SUFFIX)
+        if output in outputs:
+            raise Exception('Two input files would both be written to "{output}"!'.format(output=output))
+        outputs.add(output)
+        files.append((path, output))
+    return files
+
+
+# Compile many files on a pool of processes, one per core unless jobs is given, the results come back in the order of
+# the files. With one job everything runs in this process
+def batch_compile(inputs, output_dir=None, compile=False, optimize=0, stream=False, cache=None, jobs=None,
+                  format='json', budget=None, tier=TIER_THRESHOLD, backend='stack'):
+    files = batch_files(inputs, output_dir)
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    options = (compile, optimize, stream, cache, format, budget, tier, backend)
+    if jobs == 1 or len(files) < 2:
+        return [compile_file(path, output, *options) for path, output in files]
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        futures = [pool.submit(compile_file, path, output, *options) for path, output in files]
+        return [future.result() for future in futures]
+
+
+def print_summary(results, seconds):
+    width = max([len(result['input']) for result in results] + [4])
+    for result in results:
+        print('{input:<{width}} {seconds:>9.4f}s  {status}'.format(
+            input=result['input'], width=width, seconds=result['seconds'],
+            status='error: ' + result['error'] if result['error'] else '-> ' + result['output']))
+    failed = sum(1 for result in results if result['error'])
+    print('{count} files, {failed} failed, {total:.4f}s of work in {seconds:.4f}s'.format(
+        count=len(results), failed=failed, total=sum(result['seconds'] for result in results), seconds=seconds))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Pascal compiler/interpreter')
+    arg_parser.add_argument('input', nargs='*', default=['input_file'],
+                            help='the Pascal source files or folders, more than one file or a folder is compiled in '
+                                 'parallel and every output is written to its own .stack file')
+    arg_parser.add_argument('-c', '--compile', action='store_true',
+                            help='compile to stack code with real jumps and run it on the stack machine, '
+                                 'instead of interpreting and writing the trace')
+    arg_parser.add_argument('--stream', action='store_true',
+                            help='lex the file through mmap without reading it into memory first')
+    arg_parser.add_argument('-O', dest='optimize', type=int, default=0, choices=OPTIMIZE_LEVELS,
+                            help='-O1 folds constant expressions and runs the peephole pass on the stack code, -O2 '
+                                 'also removes the assignments whose value is never read and the unused variables, '
+                                 '-O3 also computes the common subexpressions once (not in the stack code), and '
+                                 'with --backend register moves the invariant expressions out of the loops and '
+                                 'replaces multiplications with additions and shifts')
+    arg_parser.add_argument('--cache', metavar='FOLDER',
+                            help='with -c, keep the compiled programs in FOLDER and reuse them while the source '
+                                 'does not change')
+    arg_parser.add_argument('--profile', action='store_true',
+                            help='time every phase and count tokens, statements, loop iterations and instructions, '
+                                 'and print the report')
+    arg_parser.add_argument('--profile-json', metavar='FILE',
+                            help='profile like --profile and write the report to FILE as json instead')
+    arg_parser.add_argument('-j', '--jobs', type=int, help='number of processes for a batch, one per core by default')
+    arg_parser.add_argument('--output-dir', metavar='FOLDER',
+                            help='write the outputs of a batch to FOLDER instead of next to the sources')
+    arg_parser.add_argument('--tier', metavar='N', type=int, default=TIER_THRESHOLD,
+                            help='with -c, translate a loop into python once it went around N times, 0 never does')
+    arg_parser.add_argument('--backend', choices=('stack', 'register'), default='stack',
+                            help='with -c, the stack code or three-address code on registers, its listing is written '
+                                 'to simple_stack')
+    arg_parser.add_argument('--max-iterations', metavar='N', type=int,
+                            help='stop the run when the loops went back to their top more than N times in all')
+    arg_parser.add_argument('--timeout', metavar='SECONDS', type=float, help='stop the run after SECONDS')
+    arg_parser.add_argument('--max-trace', metavar='N', type=int,
+                            help='stop the interpreter when its trace has more than N instructions')
+    arg_parser.add_argument('--format', choices=TRACE_FORMATS, default='json',
+                            help='simple_stack as a json list (the default) or as plain lines, one instruction each')
+    options = arg_parser.parse_args()
+    options.profile = options.profile or options.profile_json is not None
+    budget = Budget(options.max_iterations, options.timeout, options.max_trace)
+    if options.cache and not options.compile:
+        arg_parser.error('--cache needs -c')
+    if options.backend == 'register' and (not options.compile or options.cache or options.profile):
+        arg_parser.error('--backend register needs -c and does not work with --cache or --profile')
+    if len(options.input) > 1 or os.path.isdir(options.input[0]) or options.output_dir:
+        if options.profile:
+            arg_parser.error('--profile only works on a single file')
+        start = time.perf_counter()
+        results = batch_compile(options.input, options.output_dir, options.compile, options.optimize,
+                                options.stream, options.cache, options.jobs, options.format, budget,
+                                options.tier or None, options.backend)
+        print_summary(results, time.perf_counter() - start)
+        return 1 if any(result['error'] for result in results) else 0
+    options.input = options.input[0]
+    if options.backend == 'register':
+        return register_main(options, budget)
+    if options.profile:
+        return profile_main(options)
+    cache = code = program = before = report = None
+    if options.compile and options.cache:
+        cache = CompileCache(options.cache)
+        key = cache.file_key(options.input, options.optimize)
+        code = cache.get(key)
+    if code is None:
+        program = parse_file(options.input, options.stream)
+        if options.optimize:
+            before = len(CodeGenerator(program).generate().ops)
+            report = optimize_program(program, options.optimize)
+        if options.compile:
+            code = CodeGenerator(program, options.optimize).generate()
+            if cache is not None:
+                cache.put(key, code)
+    # then run it, the trace of the interpreter is written to simple_stack while it runs
+    try:
+        if options.compile:
+            machine = StackMachine(code, options.tier or None, budget)
+            machine.run()
+            write_trace('simple_stack', code.listing(), options.format)
+        else:
+            with TraceWriter('simple_stack', options.format) as writer:
+                machine = Interpreter(program, writer, budget)
+                machine.run()
+    except BudgetExceeded as error:
+        return budget_exceeded(error, machine)
     # Print the symbol table and the memory table
     print('Symbol table: ')
-    print(parser.symbol_table)
+    print(machine.symbol_table)
+    print('Memory table: ')
+    print(machine.memory_table)
+    if before is not None:
+        after = len((code or CodeGenerator(program, options.optimize).generate()).ops)
+        print('Instructions: {before} -> {after} (-O{level})'.format(
+            before=before, after=after, level=options.optimize))
+        for line in optimize_report(report, 'stack' if options.compile else 'interpreter'):
+            print(line)
+    elif program is None:
+        print('Compiled program loaded from the cache')
+
+
+# the lines main prints about what optimize_program found: the assignments and variables removed by -O2 and the
+# common subexpressions of -O3. backend is 'interpreter', 'stack' or 'register', the stack code computes the shared
+# subexpressions again and only RegisterGenerator optimizes the loops at -O3
+def optimize_report(report, backend):
+    lines = []
+    if 'dead_code' in report:
+        stores, declarations = report['dead_code']
+        lines.append('Removed {stores} dead assignments{to} and {count} unused variables{names}'.format(
+            stores=len(stores), to=' (to {names})'.format(names=', '.join(node.name for node in stores)) if stores
+            else '', count=len(declarations),
+            names=' ({names})'.format(names=', '.join(symbol.name for symbol in declarations)) if declarations else ''))
+    if 'shared' in report and backend == 'stack':
+        lines.append('Found {shared} common subexpressions, the stack code computes them again'.format(
+            shared=report['shared'][0]))
+    elif 'shared' in report:
+        lines.append('Shared {shared} common subexpressions, {saved} operator nodes deduplicated'.format(
+            shared=report['shared'][0], saved=report['shared'][1]))
+        if backend != 'register':
+            lines.append('Loop optimizations skipped, they need --backend register')
+    return lines
+
+
+# what main prints when a run went over its budget, simple_stack is not written then
+def budget_exceeded(error, machine):
+    print(error)
+    print('Memory table when it stopped: ')
+    print(machine.memory_table)
+    return 1
+
+
+# main with --backend register
+def register_main(options, budget):
+    program = parse_file(options.input, options.stream)
+    report = optimize_program(program, options.optimize)
+    code = RegisterGenerator(program, options.optimize).generate()
+    machine = RegisterMachine(code, budget)
+    try:
+        machine.run()
+    except BudgetExceeded as error:
+        return budget_exceeded(error, machine)
+    write_trace('simple_stack', code.listing(), options.format)
+    print('Symbol table: ')
+    print(machine.symbol_table)
+    print('Memory table: ')
+    print(machine.memory_table)
+    for line in optimize_report(report, 'register'):
+        print(line)
+
+
+# main with --profile, the compile cache is not used because cached code has no counters
+def profile_main(options):
+    profile, machine = profile_file(options.input, options.compile, options.optimize, options.stream)
+    print('Symbol table: ')
+    print(machine.symbol_table)
     print('Memory table: ')
-    print(parser.memory_table)
-    data = parser.code
-    with open('simple_stack', 'w') as outfile:
-        json.dump(data, outfile, indent=2)
+    print(machine.memory_table)
+    with profile.phase('dump'):
+        write_trace('simple_stack', machine.code.listing() if options.compile else machine.code, options.format)
+    if options.profile_json is None:
+        print(profile.report())
+    else:
+        with open(options.profile_json, 'w') as out:
+            json.dump(profile.to_dict(), out, indent=2)
 
 
-main()
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,246 @@
+# A compile and run server, so a program does not pay for starting python every time. Run from the compiler folder:
+#   python server.py serve --port 8642
+#   python server.py serve --unix /tmp/pascal.sock
+#   python server.py bench --clients 32 --requests 20
+# Every request is one line of json: {"source": "PROGRAM ...", "optimize": 0}, and every answer is one line of json with
+# the symbol table, the memory table and the stack code, or the error. Programs run on the stack machine a slice at a
+# time, the server goes to the other requests between two slices, so a long REPEAT loop does not hold up short ones.
+# Every run has a budget of loop iterations and seconds, a program that goes over it gets the error and how far it got
+# in "budget"
+import argparse
+import asyncio
+import collections
+import json
+import random
+import time
+
+import compiler
+
+# loop iterations run before the machine gives the other requests a turn
+SLICE = 2000
+# the default budget of one run
+TIMEOUT = 10.0
+
+
+# The compiled programs that were used last, the oldest one is dropped when there are more than size
+class LRUCache(object):
+
+    def __init__(self, size):
+        self.size = size
+        self.items = collections.OrderedDict()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        code = self.items.get(key)
+        if code is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.items.move_to_end(key)
+        return code
+
+    def put(self, key, code):
+        self.items[key] = code
+        self.items.move_to_end(key)
+        if len(self.items) > self.size:
+            self.items.popitem(last=False)
+
+
+class Server(object):
+
+    def __init__(self, cache_size=256, slice=SLICE, budget=None):
+        self.cache = LRUCache(cache_size)
+        self.slice = slice
+        self.budget = budget if budget is not None else compiler.Budget(seconds=TIMEOUT)
+
+    # the StackCode of a source, from the cache when the same source was compiled before
+    def compile(self, source, optimize):
+        digest = compiler.CompileCache.new_digest(optimize)
+        digest.update(source.encode('utf-8'))
+        key = digest.hexdigest()
+        code = self.cache.get(key)
+        if code is None:
+            program = compiler.Parser(compiler.Scanner(source)).program()
+            compiler.optimize_program(program, optimize)
+            code = compiler.CodeGenerator(program, optimize).generate()
+            self.cache.put(key, code)
+        return code
+
+    async def execute(self, request):
+        try:
+            code = self.compile(request['source'], request.get('optimize', 0))
+            machine = compiler.StackMachine(code, budget=self.budget.renew())
+            while not machine.run(self.slice):
+                await asyncio.sleep(0)
+        except compiler.BudgetExceeded as error:
+            return {'error': str(error), 'budget': error.stats}
+        except Exception as error:
+            return {'error': str(error)}
+        return {'symbol_table': machine.symbol_table, 'memory_table': machine.memory_table, 'code': code.listing()}
+
+    # one connection can send any number of requests, one per line
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line.decode('utf-8'))
+                except ValueError as error:
+                    answer = {'error': 'Bad request: {error}'.format(error=error)}
+                else:
+                    if not isinstance(request, dict) or not isinstance(request.get('source'), str):
+                        answer = {'error': 'Bad request: no "source"'}
+                    elif type(request.get('optimize', 0)) is not int or \
+                            request.get('optimize', 0) not in compiler.OPTIMIZE_LEVELS:
+                        answer = {'error': 'Bad request: "optimize" is not one of {levels}'.format(
+                            levels=', '.join(str(level) for level in compiler.OPTIMIZE_LEVELS))}
+                    else:
+                        answer = await self.execute(request)
+                writer.write(json.dumps(answer).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=8642, unix=None):
+        if unix is not None:
+            return await asyncio.start_unix_server(self.handle, path=unix, limit=2 ** 26)
+        return await asyncio.start_server(self.handle, host, port, limit=2 ** 26)
+
+
+def budget(options):
+    return compiler.Budget(options.max_iterations, options.timeout)
+
+
+# a slice of 0 would run a whole program at once, the other requests wait for it
+def positive(text):
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError('{value} is not 1 or more'.format(value=value))
+    return value
+
+
+# a new event loop for main, asyncio.run and Server.serve_forever need python 3.7
+def new_loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    return loop
+
+
+# answer requests until the server is stopped with ctrl-c
+def serve(options):
+    loop = new_loop()
+    server = loop.run_until_complete(Server(options.cache_size, options.slice, budget(options)).start(
+        options.host, options.port, options.unix))
+    print('listening on {where}'.format(where=options.unix or '{host}:{port}'.format(
+        host=options.host, port=server.sockets[0].getsockname()[1])))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
+
+
+# Programs for the load test: short ones with different constants so some miss the cache, and a long loop
+def short_program(i):
+    return ('PROGRAM Short;\nVAR a, b : INTEGER;\n   r : REAL;\nBEGIN\n   a := {i};\n   b := (a * 3 + 7) DIV 2;\n'
+            '   r := b / 4\nEND.'.format(i=i % 50))
+
+
+def long_program(iterations):
+    return ('PROGRAM Long;\nVAR i, s : INTEGER;\nBEGIN\n   i := 0;\n   s := 0;\n   REPEAT\n      i := i + 1;\n'
+            '      s := (s + i * 3) % 1000\n   UNTIL i >= {iterations}\nEND.'.format(iterations=iterations))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def client(host, port, sources, latencies):
+    reader, writer = await asyncio.open_connection(host, port, limit=2 ** 26)
+    for kind, source in sources:
+        start = time.perf_counter()
+        writer.write(json.dumps({'source': source}).encode('utf-8') + b'\n')
+        await writer.drain()
+        answer = json.loads((await reader.readline()).decode('utf-8'))
+        if 'error' in answer:
+            raise Exception(answer['error'])
+        latencies[kind].append(time.perf_counter() - start)
+    writer.close()
+
+
+# Start a server in this process and send it requests from many clients at once, a few of the requests are long loops.
+# Prints the latency percentiles of the short and the long requests
+async def bench(options):
+    server = await Server(options.cache_size, options.slice, budget(options)).start('127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    latencies = {'short': [], 'long': []}
+    clients = []
+    rng = random.Random(1)
+    for c in range(options.clients):
+        sources = []
+        for i in range(options.requests):
+            if rng.random() < options.long_fraction:
+                sources.append(('long', long_program(options.iterations)))
+            else:
+                sources.append(('short', short_program(c * options.requests + i)))
+        clients.append(client('127.0.0.1', port, sources, latencies))
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*clients)
+    finally:
+        server.close()
+        await server.wait_closed()
+    seconds = time.perf_counter() - start
+    count = sum(len(values) for values in latencies.values())
+    print('{count} requests from {clients} clients in {seconds:.2f}s, {rate:.0f} requests/s, slice {slice}'.format(
+        count=count, clients=options.clients, seconds=seconds, rate=count / seconds, slice=options.slice))
+    print('{kind:<6} {count:>6} {p50:>9} {p90:>9} {p99:>9} {max:>9}'.format(
+        kind='kind', count='count', p50='p50 ms', p90='p90 ms', p99='p99 ms', max='max ms'))
+    for kind, values in latencies.items():
+        if values:
+            print('{kind:<6} {count:>6} {p50:>9.2f} {p90:>9.2f} {p99:>9.2f} {max:>9.2f}'.format(
+                kind=kind, count=len(values), p50=percentile(values, 0.5) * 1e3, p90=percentile(values, 0.9) * 1e3,
+                p99=percentile(values, 0.99) * 1e3, max=max(values) * 1e3))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Pascal compile and run server')
+    commands = arg_parser.add_subparsers(dest='command')
+    command = commands.add_parser('serve', help='answer requests on a tcp port or a unix socket')
+    command.add_argument('--host', default='127.0.0.1')
+    command.add_argument('--port', type=int, default=8642)
+    command.add_argument('--unix', metavar='PATH', help='listen on a unix socket instead')
+    command = commands.add_parser('bench', help='latency percentiles of a server under concurrent load')
+    command.add_argument('--clients', type=int, default=32)
+    command.add_argument('--requests', type=int, default=20, help='requests sent by every client')
+    command.add_argument('--long-fraction', type=float, default=0.05, help='how many of the requests are long loops')
+    command.add_argument('--iterations', type=int, default=200000, help='iterations of the long loop')
+    for command in commands.choices.values():
+        command.add_argument('--cache-size', type=int, default=256, help='compiled programs kept in memory')
+        command.add_argument('--slice', type=positive, default=SLICE, help='loop iterations run before switching')
+        command.add_argument('--max-iterations', metavar='N', type=int, help='loop iterations a run may take')
+        command.add_argument('--timeout', metavar='SECONDS', type=float, default=TIMEOUT,
+                             help='seconds a run may take, waiting for other requests included')
+    options = arg_parser.parse_args()
+    if options.command == 'serve':
+        serve(options)
+    elif options.command == 'bench':
+        loop = new_loop()
+        try:
+            loop.run_until_complete(bench(options))
+        finally:
+            loop.close()
+    else:
+        arg_parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
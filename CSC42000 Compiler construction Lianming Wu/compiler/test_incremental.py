@@ -0,0 +1,80 @@
+# Checks IncrementalCompiler against compiling the whole source again after every edit, run from the compiler folder:
+#   python -m unittest test_incremental
+import os
+import random
+import unittest
+
+import compiler
+
+INPUT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'input_file')
+# what the random edits type in, pieces of statements so some of the edits do not parse
+SNIPPETS = ['7', '42', 'x', 'a := 3;', ' b := a * 2;', 'a', 'b', '1', ' ', ';', 'a := b + 1', '; c := 3',
+            'REPEAT a := a + 1 UNTIL a > 9', '{x}', '2.5', 'BEGIN', 'END', '(', ')', '*', ':=', '\n', 'd']
+
+
+# a new IncrementalCompiler of the text, or the message of the error it gives
+def full_compile(text, optimize):
+    try:
+        return compiler.IncrementalCompiler(text, optimize)
+    except Exception as error:
+        return str(error)
+
+
+class IncrementalCompilerTest(unittest.TestCase):
+
+    def setUp(self):
+        with open(INPUT_FILE) as source:
+            self.text = source.read()
+
+    def assertSameAsFull(self, incremental, full):
+        self.assertEqual(incremental.code.listing(), full.code.listing())
+        for mine, theirs in zip(compiler.walk_statements(incremental.program.block.statements),
+                                compiler.walk_statements(full.program.block.statements)):
+            self.assertIs(type(mine), type(theirs))
+            self.assertEqual((mine.start, mine.end, mine.code_start, mine.code_end),
+                             (theirs.start, theirs.end, theirs.code_start, theirs.code_end))
+
+    # random edits, after each one the code and the positions are those of a full compile of the new text
+    def test_random_edits(self):
+        rng = random.Random(12)
+        partial = 0
+        for trial in range(300):
+            optimize = trial % 2
+            text = self.text
+            incremental = compiler.IncrementalCompiler(text, optimize)
+            for _ in range(5):
+                offset = rng.randrange(len(text) + 1)
+                length = rng.randrange(min(8, len(text) - offset) + 1)
+                new = rng.choice(SNIPPETS) if rng.random() < 0.8 else ''
+                text = text[:offset] + new + text[offset + length:]
+                full = full_compile(text, optimize)
+                try:
+                    incremental.edit(offset, length, new)
+                except Exception as error:
+                    self.assertEqual(str(error), full, text)
+                    break
+                self.assertNotIsInstance(full, str, text)
+                self.assertEqual(incremental.text, text)
+                self.assertSameAsFull(incremental, full)
+                partial += incremental.reparsed is not None
+        self.assertGreater(partial, 0)
+
+    # typing over a literal again and again does not make the pool of constants grow
+    def test_constants_are_dropped(self):
+        offset = self.text.index(':=') + 3
+        incremental = compiler.IncrementalCompiler(self.text)
+        length = 0
+        for value in range(1000):
+            incremental.edit(offset, length, str(value))
+            length = len(str(value))
+            self.assertIsNotNone(incremental.reparsed)
+        full = compiler.IncrementalCompiler(incremental.text)
+        self.assertLessEqual(len(incremental.code.consts), 2 * len(full.code.consts) + 16)
+        self.assertSameAsFull(incremental, full)
+        incremental.compact()
+        self.assertEqual(incremental.code.consts, full.code.consts)
+        self.assertEqual(incremental.code.args, full.code.args)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+# Checks VectorInterpreter against the interpreter, run from the compiler folder:
+#   python -m unittest test_vectorized
+import random
+import unittest
+
+import compiler
+import vectorized
+
+
+def parse(source):
+    return compiler.Parser(compiler.Scanner(source)).program()
+
+
+# the memory table of the interpreter for a program that assigns a and b and then runs statements
+def interpret(a, b, statements):
+    machine = compiler.Interpreter(parse('PROGRAM T; VAR a, b, c, d : INTEGER; BEGIN a := {a}; b := {b}; {statements} '
+                                         'END.'.format(a=a, b=b, statements=statements)))
+    machine.run()
+    return machine.memory_table
+
+
+@unittest.skipIf(vectorized.numpy is None, 'numpy is not installed')
+class VectorInterpreterTest(unittest.TestCase):
+
+    def test_div_of_large_integers(self):
+        machine = vectorized.VectorInterpreter(parse(
+            'PROGRAM T; VAR a, b, c : INTEGER; BEGIN a := 2081918845191089988; b := 484; c := a DIV b END.'))
+        machine.run()
+        self.assertEqual(machine.memory_table['c'].tolist(), [interpret(2081918845191089988, 484, 'c := a DIV b')['c']])
+
+    # every case of the seeds gets what the interpreter computes for it alone
+    def test_div_matches_interpreter(self):
+        rng = random.Random(15)
+        a, b = [], []
+        for _ in range(200):
+            a.append(rng.choice([rng.randrange(-2 ** 63, 2 ** 63), rng.randrange(-2 ** 54, 2 ** 54),
+                                 rng.randrange(-1000, 1000)]))
+            b.append(rng.choice([rng.randrange(1, 2 ** 63), rng.randrange(1, 2 ** 54), rng.randrange(1, 1000)]) *
+                     rng.choice([1, -1]))
+        statements = 'c := a DIV b; d := (a DIV 3) DIV b + a DIV 7'
+        machine = vectorized.VectorInterpreter(parse('PROGRAM T; VAR a, b, c, d : INTEGER; BEGIN {statements} END.'
+                                                     .format(statements=statements)),
+                                               {'a': vectorized.numpy.array(a), 'b': vectorized.numpy.array(b)})
+        machine.run()
+        table = machine.memory_table
+        for case in range(len(a)):
+            expected = interpret(a[case], b[case], statements)
+            self.assertEqual((table['c'][case], table['d'][case]), (expected['c'], expected['d']),
+                             'a = {a}, b = {b}'.format(a=a[case], b=b[case]))
+
+    def test_budget(self):
+        program = parse('PROGRAM T; VAR i : INTEGER; BEGIN i := 0; REPEAT i := i + 1 UNTIL i < 0 END.')
+        machine = vectorized.VectorInterpreter(program, cases=3, budget=compiler.Budget(100))
+        with self.assertRaises(compiler.BudgetExceeded) as raised:
+            machine.run()
+        self.assertEqual(raised.exception.stats['iterations'], 100)
+        interpreter = compiler.Interpreter(parse('PROGRAM T; VAR i : INTEGER; BEGIN i := 0; REPEAT i := i + 1 '
+                                                 'UNTIL i < 0 END.'), None, compiler.Budget(100))
+        with self.assertRaises(compiler.BudgetExceeded):
+            interpreter.run()
+        self.assertEqual(machine.memory_table['i'].tolist(), [interpreter.memory_table['i']] * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,229 @@
+# Runs one program over many cases at once with numpy: every variable is an array with one value per case and every
+# operation of the program is one array operation. Run from the compiler folder:
+#   python vectorized.py input_file --seeds seeds.npz --output result.npz
+# seeds.npz holds the starting value of some of the declared variables, one array each, all of the same length. An
+# INTEGER variable needs an integer array and a REAL one a float array. A REPEAT loop keeps going only
+# for the cases whose UNTIL condition is still false, the others wait for it at the end of the loop.
+# The values are 64 bit like the memory of the interpreter, but an INTEGER result out of that range is an error as soon
+# as it is computed, where the interpreter only checks the values it stores. --max-iterations and --timeout stop a run
+# like they do for compiler.py, a loop going around once for all its cases is one iteration.
+# numpy is only needed for this file, the rest of the compiler does not use it
+import argparse
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import compiler
+
+INT_LIMIT = 2 ** 63
+# the largest INTEGER that is still exact as a float
+FLOAT_EXACT = 2 ** 53
+
+
+class VectorInterpreter(object):
+
+    # seeds maps variable names to arrays, cases is the number of cases when there are no seeds
+    def __init__(self, program, seeds=None, cases=None, budget=None):
+        if numpy is None:
+            raise Exception('The vectorized mode needs numpy, install it with "pip install numpy"!')
+        self.program = program
+        self.budget = budget if budget is not None else compiler.Budget()
+        compiler.check_types(program.block.statements)
+        self.symbol_table = dict((symbol.name, symbol.var_type) for symbol in program.declarations)
+        symbols = dict((symbol.name, symbol) for symbol in program.declarations)
+        seeds = seeds or {}
+        lengths = set(len(values) for values in seeds.values())
+        if len(lengths) > 1:
+            raise Exception('The seed arrays have different lengths: {lengths}!'.format(lengths=sorted(lengths)))
+        self.cases = lengths.pop() if lengths else cases or 1
+        # name -> array of the variables that have a value, like the flags of Memory every case gets its first value
+        # from the same statement, so a variable has a value in all the cases or in none
+        self.values = {}
+        for name, values in seeds.items():
+            symbol = symbols.get(name)
+            if symbol is None:
+                raise Exception('Variable "{name}" not declared before assignment!'.format(name=name))
+            values = numpy.asarray(values)
+            if values.dtype.kind not in ('f' if symbol.real else 'iu'):
+                raise Exception('Variable "{name}" is assigned to wrong type!'.format(name=name))
+            self.values[name] = values.astype(numpy.float64 if symbol.real else numpy.int64)
+
+    @property
+    def memory_table(self):
+        return dict((symbol.name, self.values[symbol.name]) for symbol in self.program.declarations
+                    if symbol.name in self.values)
+
+    # raise the error the interpreter gives for the first case where a failed
+    @staticmethod
+    def scalar_error(op, left, right, failed):
+        case = numpy.flatnonzero(failed)[0]
+        compiler.BINARY_OPS[op](left[case].item(), right[case].item())
+
+    @staticmethod
+    def out_of_range(target):
+        if target is None:
+            return Exception('A value in a loop condition is out of the INTEGER range!')
+        return Exception('Variable "{name}" is out of the INTEGER range!'.format(name=target))
+
+    # One operator on two arrays, with the result types and the errors of BINARY_OPS on python numbers
+    def binary(self, op, left, right, target):
+        integers = left.dtype.kind == 'i' and right.dtype.kind == 'i'
+        if op in (compiler.TK_DIV, compiler.TK_F_DIV, compiler.TK_MOD) and numpy.any(right == 0):
+            self.scalar_error(op, left, right, right == 0)
+        with numpy.errstate(over='ignore', invalid='ignore'):
+            if op == compiler.TK_ADD:
+                result = left + right
+                over = integers and numpy.any(((left ^ result) & (right ^ result)) < 0)
+            elif op == compiler.TK_MINUS:
+                result = left - right
+                over = integers and numpy.any(((left ^ right) & (left ^ result)) < 0)
+            elif op == compiler.TK_MUL:
+                result = left * right
+                over = False
+                if integers:
+                    # the float product finds the cases that may be out of range, those are checked exactly
+                    large = numpy.abs(left.astype(numpy.float64) * right) >= 2.0 ** 62
+                    over = any(not -INT_LIMIT <= int(left[case]) * int(right[case]) < INT_LIMIT
+                               for case in numpy.flatnonzero(large))
+            elif op == compiler.TK_DIV:
+                # int(left / right), truncated towards zero, always an INTEGER
+                quotient = numpy.trunc(numpy.true_divide(left, right))
+                if not numpy.all(numpy.isfinite(quotient)):
+                    self.scalar_error(op, left, right, ~numpy.isfinite(quotient))
+                exact = []
+                if integers:
+                    # numpy makes the ints floats before it divides, python divides ints above FLOAT_EXACT without
+                    # rounding them first, those cases are divided like the interpreter does
+                    exact = numpy.flatnonzero((left > FLOAT_EXACT) | (left < -FLOAT_EXACT) |
+                                              (right > FLOAT_EXACT) | (right < -FLOAT_EXACT))
+                    quotient[exact] = 0
+                over = numpy.any(numpy.abs(quotient) >= 2.0 ** 63)
+                result = quotient.astype(numpy.int64)
+                for case in exact:
+                    value = compiler.int_div(int(left[case]), int(right[case]))
+                    if not -INT_LIMIT <= value < INT_LIMIT:
+                        over = True
+                        break
+                    result[case] = value
+            elif op == compiler.TK_F_DIV:
+                result = numpy.true_divide(left, right)
+                over = False
+            else:
+                # numpy's mod has the sign of the divisor, like python's %
+                result = numpy.mod(left, right)
+                over = False
+        if over:
+            raise self.out_of_range(target)
+        return result
+
+    # Evaluate an expression for the cases in lanes, target is the variable it is assigned to for the error messages
+    def evaluate(self, node, lanes, target=None):
+        count = self.cases if isinstance(lanes, slice) else len(lanes)
+        values = []
+        for item in compiler.postfix(node):
+            if isinstance(item, compiler.Const):
+                if isinstance(item.value, float):
+                    values.append(numpy.full(count, item.value, numpy.float64))
+                elif -INT_LIMIT <= item.value < INT_LIMIT:
+                    values.append(numpy.full(count, item.value, numpy.int64))
+                else:
+                    raise self.out_of_range(target)
+            elif isinstance(item, compiler.Var):
+                if item.name not in self.values:
+                    raise Exception('"{var}" has not be declared or don"t have value assigned!'.format(var=item.name))
+                values.append(self.values[item.name][lanes])
+            elif isinstance(item, compiler.UnaryOp):
+                if item.op == compiler.TK_MINUS:
+                    if values[-1].dtype.kind == 'i' and numpy.any(values[-1] == -INT_LIMIT):
+                        raise self.out_of_range(target)
+                    values[-1] = -values[-1]
+            else:
+                right = values.pop()
+                values[-1] = self.binary(item.op, values[-1], right, target)
+        return values[0]
+
+    def assignment(self, node, lanes):
+        # check_types made sure the variable is declared and the array has its type
+        right = self.evaluate(node.expr, lanes, node.name)
+        if node.name not in self.values:
+            self.values[node.name] = numpy.zeros(self.cases, right.dtype)
+        self.values[node.name][lanes] = right
+
+    # the cases for which the UNTIL condition is true
+    def comparison(self, node, lanes):
+        left = self.evaluate(node.left, lanes)
+        return compiler.COMPARE_OPS[node.op](left, self.evaluate(node.right, lanes))
+
+    # Blocks and loops on an explicit stack of [statements, index, loop, lanes] frames like Interpreter.run, lanes are
+    # the cases still running the loop, a slice while that is all of them. The budget is counted like Interpreter.run
+    def run(self):
+        budget = self.budget
+        fuel = budget.start()
+        steps = compiler.BUDGET_STEPS
+        stack = [[self.program.block.statements, 0, None, slice(None)]]
+        while stack:
+            frame = stack[-1]
+            statements, index, loop, lanes = frame
+            if index < len(statements):
+                steps -= 1
+                if not steps:
+                    steps = budget.look(fuel)
+                frame[1] = index + 1
+                node = statements[index]
+                if isinstance(node, compiler.Assign):
+                    self.assignment(node, lanes)
+                elif isinstance(node, compiler.Block):
+                    stack.append([node.statements, 0, None, lanes])
+                else:
+                    stack.append([node.body, 0, node, lanes])
+            elif loop is not None:
+                done = self.comparison(loop.condition, lanes)
+                if numpy.all(done):
+                    stack.pop()
+                else:
+                    if isinstance(lanes, slice):
+                        lanes = numpy.arange(self.cases)
+                    frame[1] = 0
+                    frame[3] = lanes[~done]
+                    fuel -= 1
+                    if not fuel:
+                        fuel = budget.check()
+            else:
+                stack.pop()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='run a Pascal program over many cases at once with numpy')
+    arg_parser.add_argument('input', nargs='?', default='input_file', help='the Pascal source file')
+    arg_parser.add_argument('--seeds', metavar='FILE', help='.npz file with the starting arrays of the variables')
+    arg_parser.add_argument('--cases', type=int, help='number of cases when there are no seeds')
+    arg_parser.add_argument('--output', metavar='FILE', help='write the memory table to FILE as .npz')
+    arg_parser.add_argument('--max-iterations', metavar='N', type=int,
+                            help='stop the run when the loops went back to their top more than N times in all')
+    arg_parser.add_argument('--timeout', metavar='SECONDS', type=float, help='stop the run after SECONDS')
+    options = arg_parser.parse_args()
+    seeds = None
+    if options.seeds:
+        if numpy is None:
+            raise Exception('The vectorized mode needs numpy, install it with "pip install numpy"!')
+        with numpy.load(options.seeds) as archive:
+            seeds = dict((name, archive[name]) for name in archive.files)
+    machine = VectorInterpreter(compiler.parse_file(options.input), seeds, options.cases,
+                                compiler.Budget(options.max_iterations, options.timeout))
+    try:
+        machine.run()
+    except compiler.BudgetExceeded as error:
+        return compiler.budget_exceeded(error, machine)
+    print('Symbol table: ')
+    print(machine.symbol_table)
+    print('Memory table: ')
+    print(machine.memory_table)
+    if options.output:
+        numpy.savez(options.output, **machine.memory_table)
+
+
+if __name__ == '__main__':
+    sys.exit(main())